@@ -0,0 +1,189 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import func
+from sqlmodel import Session, select
+from .db import get_generation, session_owner
+from .models import Contact, ConversationContactLink, Direction, Media, Message
+
+CACHE_SIZE = 256
+
+# Gaps longer than this aren't counted as a reply, the thread just went quiet
+REPLY_CUTOFF_SECONDS = 24 * 60 * 60
+
+# julianday() of the unix epoch, used to turn SQLite dates into epoch seconds
+# without building a datetime object per row
+UNIX_EPOCH_JULIANDAY = 2440587.5
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_message_columns(session: Session, where) -> dict[str, np.ndarray]:
+    """Pull date, direction and contact of every matching message into arrays"""
+    rows = session.exec(
+        select(
+            (func.julianday(Message.date) - UNIX_EPOCH_JULIANDAY) * 86400,
+            Message.direction == Direction.sent,
+            Message.contact_id,
+        )
+        .where(where)
+        .order_by(Message.date)
+    ).all()
+
+    columns = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return {
+        # julianday() is a float, round off the error it leaves behind
+        "date": np.round(columns[:, 0], 3),
+        "sent": columns[:, 1].astype(bool),
+        "contact_id": columns[:, 2].astype(np.int64),
+    }
+
+
+def messages_per_month(date: np.ndarray, sent: np.ndarray) -> list[dict]:
+    months = date.astype("datetime64[s]").astype("datetime64[M]")
+    unique, inverse = np.unique(months, return_inverse=True)
+    total = np.bincount(inverse, minlength=len(unique))
+    sent_count = np.bincount(inverse, weights=sent, minlength=len(unique))
+
+    return [
+        {
+            "month": str(month),
+            "count": int(count),
+            "sent": int(sent_n),
+            "received": int(count - sent_n),
+        }
+        for month, count, sent_n in zip(unique, total, sent_count)
+    ]
+
+
+def reply_latency(date: np.ndarray, sent: np.ndarray) -> dict:
+    """Median time between a message and the first answer from the other side"""
+    if len(date) < 2:
+        return {"sent": None, "received": None}
+
+    flips = sent[1:] != sent[:-1]
+    gaps = np.diff(date)
+    replies = flips & (gaps <= REPLY_CUTOFF_SECONDS)
+    # sent[1:] is the direction of the reply itself
+    my_replies = gaps[replies & sent[1:]]
+    their_replies = gaps[replies & ~sent[1:]]
+
+    return {
+        "sent": float(np.median(my_replies)) if len(my_replies) else None,
+        "received": float(np.median(their_replies)) if len(their_replies) else None,
+    }
+
+
+def busiest_hours(date: np.ndarray) -> list[int]:
+    hours = (date // 3600).astype(np.int64) % 24
+    return np.bincount(hours, minlength=24).tolist()
+
+
+def busiest_weekdays(date: np.ndarray) -> list[int]:
+    """Counts indexed Monday to Sunday, 1970-01-01 was a Thursday"""
+    weekdays = ((date // 86400).astype(np.int64) + 3) % 7
+    return np.bincount(weekdays, minlength=7).tolist()
+
+
+def top_senders(session: Session, senders: np.ndarray, limit: int = 10) -> list[dict]:
+    """Rank contact ids by how often they appear in `senders`"""
+    if not len(senders):
+        return []
+
+    contact_ids, counts = np.unique(senders, return_counts=True)
+    top = np.argsort(counts)[::-1][:limit]
+
+    contacts = {
+        contact.id: contact
+        for contact in session.exec(
+            select(Contact).where(Contact.id.in_(contact_ids[top].tolist()))
+        ).all()
+    }
+
+    results = []
+    for index in top:
+        contact = contacts.get(int(contact_ids[index]))
+        results.append(
+            {
+                "contact_id": int(contact_ids[index]),
+                "name": contact.name if contact else None,
+                "address": contact.address if contact else None,
+                "count": int(counts[index]),
+            }
+        )
+
+    return results
+
+
+def top_media_senders(session: Session, where, limit: int = 10) -> list[dict]:
+    senders = np.array(
+        session.exec(select(Message.contact_id).join(Media).where(where)).all(),
+        dtype=np.int64,
+    ).reshape(-1)
+
+    return top_senders(session, senders, limit)
+
+
+def compute_analytics(session: Session, where) -> dict:
+    columns = load_message_columns(session, where)
+    date, sent = columns["date"], columns["sent"]
+    total = len(date)
+    sent_count = int(sent.sum())
+
+    return {
+        "total": total,
+        "sent": sent_count,
+        "received": total - sent_count,
+        "sent_ratio": sent_count / total if total else None,
+        "first_message": str(date[0].astype("datetime64[s]")) if total else None,
+        "last_message": str(date[-1].astype("datetime64[s]")) if total else None,
+        "messages_per_month": messages_per_month(date, sent),
+        "median_reply_seconds": reply_latency(date, sent),
+        "busiest_hours": busiest_hours(date),
+        "busiest_weekdays": busiest_weekdays(date),
+        "top_senders": top_senders(session, columns["contact_id"]),
+        "top_media_senders": top_media_senders(session, where),
+    }
+
+
+def cached_analytics(session: Session, key: tuple, where) -> dict:
+    version = get_generation(session)
+    # Ids are only unique within one owner's database
+    key = (session_owner(session), *key)
+
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == version:
+            _cache.move_to_end(key)
+            return cached[1]
+
+    result = compute_analytics(session, where)
+
+    with _cache_lock:
+        _cache[key] = (version, result)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return result
+
+
+def conversation_analytics(session: Session, conversation_id: int) -> dict:
+    return cached_analytics(
+        session,
+        ("conversation", conversation_id),
+        Message.conversation_id == conversation_id,
+    )
+
+
+def contact_analytics(session: Session, contact_id: int) -> dict:
+    """Stats across every conversation the contact takes part in"""
+    conversation_ids = select(ConversationContactLink.conversation_id).where(
+        ConversationContactLink.contact_id == contact_id
+    )
+    return cached_analytics(
+        session,
+        ("contact", contact_id),
+        Message.conversation_id.in_(conversation_ids),
+    )
@@ -1,14 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
 from sqlmodel import Session, select
-from app.models import Contact, Message, Media, Conversation
-from app.db import get_session
+from app.models import Contact, Message, Media, MediaKind, Conversation
+from app.db import get_session, pack_dir, session_owner
+from app.packstore import get_pack_reader
+from app.compact import compact_media, compact_messages, encode, wants_compact
+from app.cache import cached_route
+from app.federation import fan_out, federated_owners
 from pathlib import Path
 import mimetypes
 import hashlib
 import os
 from datetime import datetime
-from sqlalchemy import func
+import heapq
+import itertools
+from sqlalchemy import func, tuple_
 from sqlalchemy.orm import selectinload
 
 router = APIRouter()
@@ -38,8 +44,11 @@ def serialize_message_with_media(msg: Message, session: Session):
 
 
 @router.get("/conversations")
+@cached_route
 def list_conversations(
-    search: str | None = None, session: Session = Depends(get_session)
+    request: Request,
+    search: str | None = None,
+    session: Session = Depends(get_session),
 ):
     query = select(Conversation)
     if search:
@@ -65,8 +74,9 @@ def list_conversations(
 
 
 @router.get("/conversation/{conversation_id}")
+@cached_route
 def get_conversation_by_id(
-    conversation_id: int, session: Session = Depends(get_session)
+    conversation_id: int, request: Request, session: Session = Depends(get_session)
 ):
     conversation = session.get(Conversation, conversation_id)
     if not conversation:
@@ -87,12 +97,15 @@ def get_conversation_by_id(
 
 
 @router.get("/conversation/{conversation_id}/messages")
+@cached_route
 def get_messages_for_conversation(
     conversation_id: int,
+    request: Request,
     session: Session = Depends(get_session),
     limit: int = Query(50, ge=1, le=100),
     start_before_message_id: int | None = Query(None),
     start_after_message_id: int | None = Query(None),
+    format: str | None = Query(None, pattern="^(compact)$"),
 ):
     base_query = select(Message).where(Message.conversation_id == conversation_id)
 
@@ -154,6 +167,17 @@ def get_messages_for_conversation(
         )
         has_newer = result.one() > 0
 
+    if wants_compact(request, format):
+        return encode(
+            request,
+            {
+                **compact_messages(messages, session),
+                "total": total,
+                "has_more": has_more,
+                "has_newer": has_newer,
+            },
+        )
+
     return {
         "messages": [serialize_message_with_media(m, session) for m in messages],
         "total": total,
@@ -162,30 +186,71 @@ def get_messages_for_conversation(
     }
 
 
+def encode_media_cursor(media: Media) -> str:
+    return f"{media.date.isoformat()}_{media.id}"
+
+
+def decode_media_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        date, _, media_id = cursor.rpartition("_")
+        return datetime.fromisoformat(date), int(media_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/conversation/{conversation_id}/media")
+@cached_route
 def get_media_for_conversation(
     conversation_id: int,
+    request: Request,
     session: Session = Depends(get_session),
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    before: str | None = Query(None),
+    kind: MediaKind | None = Query(None),
+    format: str | None = Query(None, pattern="^(compact)$"),
 ):
-    total = session.exec(
-        select(func.count(Media.id))
-        .join(Message)
-        .where(Message.conversation_id == conversation_id)
-    ).one()
+    """
+    Media newest first. Pass the `next_cursor` of a page as `before` to get
+    the next one, which stays fast however deep the gallery is paged.
+    """
+    query = select(Media).where(Media.conversation_id == conversation_id)
+    if kind:
+        query = query.where(Media.kind == kind)
+
+    # Only count on the first page, the count doesn't change while paging
+    total = None
+    if not before and not offset:
+        total = session.exec(
+            query.with_only_columns(func.count(Media.id)).order_by(None)
+        ).one()
+
+    if before:
+        date, media_id = decode_media_cursor(before)
+        query = query.where(tuple_(Media.date, Media.id) < (date, media_id))
+    elif offset:
+        query = query.offset(offset)
 
     media_items = session.exec(
-        select(Media)
-        .join(Message)
-        .options(selectinload(Media.message))
-        .where(Message.conversation_id == conversation_id)
-        .order_by(Message.date.desc())
-        .offset(offset)
-        .limit(limit)
+        query.options(selectinload(Media.message).selectinload(Message.contact))
+        .order_by(Media.date.desc(), Media.id.desc())
+        .limit(limit + 1)
     ).all()
 
-    has_more = offset + limit < total
+    has_more = len(media_items) > limit
+    media_items = media_items[:limit]
+    next_cursor = encode_media_cursor(media_items[-1]) if has_more else None
+
+    if wants_compact(request, format):
+        return encode(
+            request,
+            {
+                **compact_media(media_items, session),
+                "total": total,
+                "has_more": has_more,
+                "next_cursor": next_cursor,
+            },
+        )
 
     def serialize_media(media: Media):
         message = media.message
@@ -194,8 +259,11 @@ def get_media_for_conversation(
             "id": media.id,
             "content_type": media.content_type,
             "filename": media.filename,
-            "message_id": message.id if message else None,
-            "date": message.date if message else None,
+            "kind": media.kind,
+            "width": media.width,
+            "height": media.height,
+            "message_id": media.message_id,
+            "date": media.date,
             "contact_id": contact.id if contact else None,
             "name": contact.name if contact else None,
             "address": contact.address if contact else None,
@@ -205,6 +273,7 @@ def get_media_for_conversation(
         "media": [serialize_media(m) for m in media_items],
         "total": total,
         "has_more": has_more,
+        "next_cursor": next_cursor,
     }
 
 
@@ -225,6 +294,134 @@ def search_messages_for_conversation(
     return [serialize_message_with_media(m, session) for m in messages]
 
 
+@router.get("/federated/owners")
+def list_federated_owners():
+    return federated_owners(None)
+
+
+@router.get("/federated/conversations")
+def list_federated_conversations(
+    search: str | None = None, owners: str | None = Query(None)
+):
+    """Conversations of every owner, tagged with the owner they belong to"""
+
+    def query(session: Session):
+        statement = select(Conversation).options(selectinload(Conversation.contacts))
+        if search:
+            statement = statement.where(Conversation.name.ilike(f"%{search}%"))
+
+        return [
+            {
+                "id": c.id,
+                "name": c.name,
+                "contacts": [
+                    {"id": contact.id, "address": contact.address, "name": contact.name}
+                    for contact in c.contacts
+                ],
+            }
+            for c in session.exec(statement).all()
+        ]
+
+    results, errors = fan_out(federated_owners(owners), query)
+
+    conversations = [
+        {"owner": owner, **conversation}
+        for owner, owner_conversations in results.items()
+        for conversation in owner_conversations
+    ]
+    conversations.sort(key=lambda c: ((c["name"] or "").lower(), c["owner"]))
+
+    return {"conversations": conversations, "errors": errors}
+
+
+@router.get("/federated/search")
+def search_federated_messages(
+    query: str = Query(..., min_length=1),
+    owners: str | None = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    before: datetime | None = Query(None),
+):
+    """
+    Newest messages matching `query` across owners. Pass the date of the
+    last message as `before` for the next page.
+    """
+
+    def search(session: Session):
+        statement = (
+            select(Message)
+            .options(selectinload(Message.media))
+            .where(Message.text.ilike(f"%{query}%"))
+        )
+        if before:
+            statement = statement.where(Message.date < before)
+
+        messages = session.exec(
+            statement.order_by(Message.date.desc()).limit(limit)
+        ).all()
+        return [
+            {
+                "conversation_id": m.conversation_id,
+                **serialize_message_with_media(m, session),
+            }
+            for m in messages
+        ]
+
+    results, errors = fan_out(federated_owners(owners), search)
+
+    # Each owner's results are already newest first
+    merged = heapq.merge(
+        *(
+            [{"owner": owner, **message} for message in messages]
+            for owner, messages in results.items()
+        ),
+        key=lambda message: message["date"],
+        reverse=True,
+    )
+    messages = list(itertools.islice(merged, limit))
+
+    return {
+        "messages": messages,
+        # Either some results didn't fit, or an owner may have more to give
+        "has_more": sum(len(m) for m in results.values()) > len(messages)
+        or any(len(m) == limit for m in results.values()),
+        "errors": errors,
+    }
+
+
+@router.get("/analytics/conversation/{conversation_id}")
+def get_conversation_analytics(
+    conversation_id: int, session: Session = Depends(get_session)
+):
+    conversation = session.get(Conversation, conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    # Imported here so numpy isn't loaded until analytics are first asked for
+    from app.analytics import conversation_analytics
+
+    return {
+        "id": conversation.id,
+        "name": conversation.name,
+        **conversation_analytics(session, conversation_id),
+    }
+
+
+@router.get("/analytics/contact/{contact_id}")
+def get_contact_analytics(contact_id: int, session: Session = Depends(get_session)):
+    contact = session.get(Contact, contact_id)
+    if not contact:
+        raise HTTPException(status_code=404, detail="Contact not found")
+
+    from app.analytics import contact_analytics
+
+    return {
+        "id": contact.id,
+        "name": contact.name,
+        "address": contact.address,
+        **contact_analytics(session, contact_id),
+    }
+
+
 @router.get("/messages/{message_id}")
 def get_message_by_id(message_id: int, session: Session = Depends(get_session)):
     statement = (
@@ -276,12 +473,67 @@ def get_media_metadata(media_id: str, session: Session = Depends(get_session)):
     }
 
 
+def parse_range(range_header: str | None, length: int) -> tuple[int, int] | None:
+    """Parse a single `bytes=start-end` range, returning inclusive bounds"""
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+
+    start, _, end = range_header[len("bytes=") :].split(",")[0].strip().partition("-")
+    try:
+        if not start:
+            # Suffix range, e.g. "bytes=-500" for the last 500 bytes
+            start, end = max(length - int(end), 0), length - 1
+        else:
+            start, end = int(start), int(end) if end else length - 1
+    except ValueError:
+        return None
+
+    if start > end or start >= length:
+        raise HTTPException(
+            status_code=416, headers={"Content-Range": f"bytes */{length}"}
+        )
+
+    return start, min(end, length - 1)
+
+
+def serve_packed_media(media: Media, request: Request, owner: str):
+    content_type = (
+        media.content_type
+        or mimetypes.guess_type(media.filename or "")[0]
+        or "application/octet-stream"
+    )
+    headers = {
+        "ETag": f'"{media.pack_segment}-{media.pack_offset}-{media.pack_length}"',
+        "Accept-Ranges": "bytes",
+    }
+
+    byte_range = parse_range(request.headers.get("range"), media.pack_length)
+    start, end = byte_range if byte_range else (0, media.pack_length - 1)
+
+    data = get_pack_reader(pack_dir(owner)).read(
+        media.pack_segment, media.pack_offset, media.pack_length, start, end
+    )
+    if data is None:
+        raise HTTPException(status_code=404, detail="Media pack segment missing")
+
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{media.pack_length}"
+        return Response(data, status_code=206, media_type=content_type, headers=headers)
+
+    return Response(data, media_type=content_type, headers=headers)
+
+
 @router.get("/media/{media_id}/cache")
-def serve_media_file(media_id: int, session: Session = Depends(get_session)):
+def serve_media_file(
+    media_id: int, request: Request, session: Session = Depends(get_session)
+):
     media = session.get(Media, media_id)
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
+    if media.pack_segment is not None:
+        return serve_packed_media(media, request, session_owner(session))
+
     if not os.path.exists(media.file_path):
         raise HTTPException(status_code=404, detail="Media file missing on disk")
 
@@ -0,0 +1,161 @@
+import functools
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from sqlmodel import Session
+from .db import get_generation, session_owner
+from .migrations import LATEST_VERSION
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1024))
+# Optional second tier that survives restarts, e.g. /data/cache
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR")
+# 0 makes browsers revalidate with the ETag on every use, which is a cheap
+# 304 until the next import
+RESPONSE_CACHE_MAX_AGE = int(os.environ.get("RESPONSE_CACHE_MAX_AGE", 0))
+# Bump when a cached route's response changes shape. Together with the
+# schema version (migrations can rewrite rows without an import) it keeps
+# the disk tier and browsers from getting bodies from an older release.
+RESPONSE_FORMAT = 1
+CACHE_VERSION = f"{RESPONSE_FORMAT}.{LATEST_VERSION}"
+
+
+class ResponseCache:
+    """
+    LRU of encoded response bodies keyed by owner, cache version, data
+    generation and request. Entries from older generations or versions are
+    never hit again and age out.
+    """
+
+    def __init__(self, max_entries: int, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.entries: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk_generations: dict[str, int] = {}
+
+    def _entry_key(self, owner: str, generation: int, key: str) -> str:
+        return f"{owner}:{CACHE_VERSION}:{generation}:{key}"
+
+    def _disk_path(self, owner: str, generation: int, key: str) -> Path:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.disk_dir / owner / self._disk_tag(generation) / digest[:2] / digest
+
+    def _disk_tag(self, generation: int) -> str:
+        return f"v{CACHE_VERSION}-{generation}"
+
+    def get(self, owner: str, generation: int, key: str) -> Optional[tuple[bytes, str]]:
+        with self.lock:
+            entry_key = self._entry_key(owner, generation, key)
+            entry = self.entries.get(entry_key)
+            if entry is not None:
+                self.entries.move_to_end(entry_key)
+                return entry
+
+        if self.disk_dir is None:
+            return None
+
+        try:
+            media_type, _, body = (
+                self._disk_path(owner, generation, key).read_bytes().partition(b"\n")
+            )
+        except FileNotFoundError:
+            return None
+
+        entry = (body, media_type.decode())
+        self._remember(self._entry_key(owner, generation, key), entry)
+        return entry
+
+    def set(self, owner: str, generation: int, key: str, body: bytes, media_type: str):
+        self._remember(self._entry_key(owner, generation, key), (body, media_type))
+
+        if self.disk_dir is not None:
+            self._write_disk(owner, generation, key, body, media_type)
+
+    def _remember(self, key: str, entry: tuple[bytes, str]):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _write_disk(
+        self, owner: str, generation: int, key: str, body: bytes, media_type: str
+    ):
+        if self.disk_generations.get(owner) != generation:
+            # First write for a new generation or release, anything else
+            # there is stale
+            self.disk_generations[owner] = generation
+            owner_dir = self.disk_dir / owner
+            if owner_dir.exists():
+                for old in owner_dir.iterdir():
+                    if old.name != self._disk_tag(generation):
+                        shutil.rmtree(old, ignore_errors=True)
+
+        path = self._disk_path(owner, generation, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(media_type.encode() + b"\n" + body)
+        tmp.replace(path)
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_DIR)
+
+
+def cache_headers(etag: str) -> dict:
+    if RESPONSE_CACHE_MAX_AGE > 0:
+        cache_control = f"private, max-age={RESPONSE_CACHE_MAX_AGE}"
+    else:
+        cache_control = "private, no-cache"
+
+    return {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept, X-Owner"}
+
+
+def cached_response(request: Request, session: Session, build) -> Response:
+    """
+    Serve the response `build()` would produce from the cache when the
+    archive hasn't changed since it was stored, or a 304 when the client
+    already has it.
+    """
+    owner = session_owner(session)
+    generation = get_generation(session)
+    key = f"{request.url.path}?{request.url.query}|{request.headers.get('accept', '')}"
+    digest = hashlib.sha1(f"{owner}|{key}".encode()).hexdigest()[:16]
+    etag = f'W/"{CACHE_VERSION}-{generation}-{digest}"'
+    headers = cache_headers(etag)
+
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    entry = response_cache.get(owner, generation, key)
+    if entry is None:
+        result = build()
+        if not isinstance(result, Response):
+            result = JSONResponse(jsonable_encoder(result))
+
+        entry = (result.body, result.media_type)
+        response_cache.set(owner, generation, key, *entry)
+
+    body, media_type = entry
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def cached_route(endpoint):
+    """
+    Cache a route's responses by data generation. The route must take
+    `request: Request` and `session: Session` arguments.
+    """
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        return cached_response(
+            kwargs["request"], kwargs["session"], lambda: endpoint(*args, **kwargs)
+        )
+
+    return wrapper
@@ -0,0 +1,93 @@
+import msgpack
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from sqlmodel import Session, select
+from .models import Contact, Media, Message
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return any(media_type in accept for media_type in MSGPACK_TYPES)
+
+
+def wants_compact(request: Request, format: str | None) -> bool:
+    return format == "compact" or wants_msgpack(request)
+
+
+class ContactTable:
+    """Assigns each contact an index into a list sent once per response"""
+
+    def __init__(self, session: Session, contact_ids):
+        contacts = session.exec(
+            select(Contact).where(Contact.id.in_(set(contact_ids)))
+        ).all()
+        self.contacts = sorted(contacts, key=lambda c: c.id)
+        self.index = {contact.id: i for i, contact in enumerate(self.contacts)}
+
+    def serialize(self) -> dict:
+        return {
+            "id": [contact.id for contact in self.contacts],
+            "name": [contact.name for contact in self.contacts],
+            "address": [contact.address for contact in self.contacts],
+        }
+
+
+def compact_messages(messages: list[Message], session: Session) -> dict:
+    """
+    Messages as parallel arrays. `contact` holds indexes into `contacts`
+    and each media entry points back at its message by index.
+    """
+    contacts = ContactTable(session, [m.contact_id for m in messages])
+    media = [(i, m) for i, msg in enumerate(messages) for m in msg.media]
+
+    return {
+        "contacts": contacts.serialize(),
+        "messages": {
+            "id": [m.id for m in messages],
+            "direction": [m.direction.value for m in messages],
+            "text": [m.text for m in messages],
+            "date": [m.date.isoformat() for m in messages],
+            "contact": [contacts.index[m.contact_id] for m in messages],
+        },
+        "media": {
+            "message": [i for i, _ in media],
+            "id": [m.id for _, m in media],
+            "filename": [m.filename for _, m in media],
+            "content_type": [m.content_type for _, m in media],
+        },
+    }
+
+
+def compact_media(media_items: list[Media], session: Session) -> dict:
+    messages = [media.message for media in media_items]
+    contacts = ContactTable(session, [m.contact_id for m in messages if m])
+
+    return {
+        "contacts": contacts.serialize(),
+        "media": {
+            "id": [media.id for media in media_items],
+            "content_type": [media.content_type for media in media_items],
+            "filename": [media.filename for media in media_items],
+            "kind": [media.kind.value if media.kind else None for media in media_items],
+            "width": [media.width for media in media_items],
+            "height": [media.height for media in media_items],
+            "message_id": [media.message_id for media in media_items],
+            "date": [media.date.isoformat() for media in media_items],
+            "contact": [contacts.index[m.contact_id] if m else None for m in messages],
+        },
+    }
+
+
+def encode(request: Request, body: dict):
+    """Return `body` as MessagePack when the client asked for it, JSON otherwise"""
+    body = {**body, "format": "compact"}
+    headers = {"Vary": "Accept"}
+
+    if wants_msgpack(request):
+        return Response(
+            msgpack.packb(body), media_type="application/msgpack", headers=headers
+        )
+
+    return JSONResponse(body, headers=headers)
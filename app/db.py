@@ -1,9 +1,197 @@
-from sqlmodel import Session, create_engine
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import inspect, update
+from sqlalchemy.engine import Engine
+from sqlmodel import SQLModel, Session, create_engine
+from .migrations import (
+    BATCH_SIZE,
+    LATEST_VERSION,
+    migrate,
+    migration_lock,
+    optimize,
+    schema_version,
+)
+from .models import DataGeneration
 
+DATA_DIR = Path("/data")
 sqlite_file_name = "sms.db"
-engine = create_engine(f"sqlite:////data/{sqlite_file_name}", echo=False)
 
+# The default owner keeps the original /data/sms.db and /data/media layout,
+# everyone else gets their own database and media under /data/owners/<owner>
+DEFAULT_OWNER = "default"
+OWNERS_DIR = DATA_DIR / "owners"
+OWNER_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
 
-def get_session():
-    with Session(engine) as session:
+engine = create_engine(f"sqlite:///{DATA_DIR / sqlite_file_name}", echo=False)
+
+_engines: dict[str, Engine] = {}
+# Guards _engines and engine_hooks. Creating and upgrading an owner's
+# engine holds only that owner's lock, so a slow migration of one archive
+# doesn't hold up requests for anyone else.
+_engines_lock = threading.Lock()
+_owner_locks: dict[str, threading.Lock] = {}
+# Called with each new owner engine, e.g. to install SQL tracing
+engine_hooks = []
+
+
+def valid_owner(owner: str) -> bool:
+    return owner == DEFAULT_OWNER or bool(OWNER_PATTERN.match(owner))
+
+
+def owner_dir(owner: str = DEFAULT_OWNER) -> Path:
+    if owner == DEFAULT_OWNER:
+        return DATA_DIR
+
+    if not valid_owner(owner):
+        raise ValueError(f"Invalid owner {owner!r}")
+
+    return OWNERS_DIR / owner
+
+
+def media_dir(owner: str = DEFAULT_OWNER) -> Path:
+    return owner_dir(owner) / "media"
+
+
+def pack_dir(owner: str = DEFAULT_OWNER) -> Path:
+    return media_dir(owner) / "packs"
+
+
+def owner_exists(owner: str) -> bool:
+    return valid_owner(owner) and (owner_dir(owner) / sqlite_file_name).exists()
+
+
+def list_owners() -> list[str]:
+    owners = [DEFAULT_OWNER] if owner_exists(DEFAULT_OWNER) else []
+    if OWNERS_DIR.is_dir():
+        owners += sorted(
+            path.name
+            for path in OWNERS_DIR.iterdir()
+            if path.is_dir() and owner_exists(path.name)
+        )
+
+    return owners
+
+
+def get_engine(owner: str = DEFAULT_OWNER) -> Engine:
+    """
+    Engine for an owner's database, creating the database and bringing its
+    schema up to date the first time the owner is used in this process
+    """
+    owner_engine = _engines.get(owner)
+    if owner_engine is not None:
+        return owner_engine
+
+    with _engines_lock:
+        owner_lock = _owner_locks.setdefault(owner, threading.Lock())
+        hooks = list(engine_hooks)
+
+    with owner_lock:
+        owner_engine = _engines.get(owner)
+        if owner_engine is not None:
+            return owner_engine
+
+        media_dir(owner).mkdir(parents=True, exist_ok=True)
+        if owner == DEFAULT_OWNER:
+            owner_engine = engine
+        else:
+            owner_engine = create_engine(
+                f"sqlite:///{owner_dir(owner) / sqlite_file_name}"
+            )
+
+        for hook in hooks:
+            hook(owner_engine)
+        upgrade_schema(owner_engine)
+
+        with _engines_lock:
+            # Hooks added while the schema was being upgraded
+            for hook in engine_hooks[len(hooks) :]:
+                hook(owner_engine)
+            _engines[owner] = owner_engine
+
+        return owner_engine
+
+
+def add_engine_hook(hook):
+    with _engines_lock:
+        engine_hooks.append(hook)
+        for owner_engine in _engines.values():
+            hook(owner_engine)
+
+
+def owner_session(owner: str = DEFAULT_OWNER) -> Session:
+    session = Session(get_engine(owner))
+    session.info["owner"] = owner
+    return session
+
+
+def session_owner(session: Session) -> str:
+    return session.info.get("owner", DEFAULT_OWNER)
+
+
+def get_owner(request: Request) -> str:
+    """The owner a request reads from, from X-Owner or ?owner="""
+    owner = (
+        request.headers.get("x-owner")
+        or request.query_params.get("owner")
+        or DEFAULT_OWNER
+    )
+    if not valid_owner(owner):
+        raise HTTPException(status_code=400, detail="Invalid owner")
+
+    # Never create a database for an owner nobody has imported anything for
+    if owner != DEFAULT_OWNER and not owner_exists(owner):
+        raise HTTPException(status_code=404, detail="Owner not found")
+
+    return owner
+
+
+def get_session(owner: str = Depends(get_owner)):
+    with owner_session(owner) as session:
         yield session
+
+
+def upgrade_schema(engine, batch_size: int = BATCH_SIZE):
+    """
+    create_all() only creates missing tables, changes to existing tables
+    are applied by the versioned migrations. An up to date database is
+    recognized from its header alone, which keeps startup fast.
+    """
+    if schema_version(engine) >= LATEST_VERSION:
+        return
+
+    with migration_lock(engine):
+        # Another process may have finished the upgrade while we waited
+        if schema_version(engine) >= LATEST_VERSION:
+            return
+
+        new_database = not inspect(engine).get_table_names()
+        SQLModel.metadata.create_all(engine)
+        migrate(engine, batch_size, new_database=new_database)
+
+
+def get_generation(session: Session) -> int:
+    generation = session.get(DataGeneration, 1)
+    return generation.generation if generation else 0
+
+
+def bump_generation(session: Session):
+    """
+    Mark cached responses stale and refresh the planner's statistics, call
+    after committing imported data
+    """
+    result = session.execute(
+        update(DataGeneration)
+        .where(DataGeneration.id == 1)
+        .values(generation=DataGeneration.generation + 1, updated_at=datetime.now())
+    )
+    if result.rowcount == 0:
+        session.add(DataGeneration(id=1, generation=1, updated_at=datetime.now()))
+
+    session.commit()
+
+    # Migrations only analyze on upgrade, and a new database never, so
+    # without this a large first import would leave the planner guessing
+    optimize(session.get_bind(), analyze=True)
@@ -0,0 +1,223 @@
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+from .db import bump_generation
+from .models import Contact, ConversationContactLink, Direction, Media, Message
+
+UNIX_EPOCH_JULIANDAY = 2440587.5
+
+# Characters that one export keeps and the other drops, e.g. iMessage's
+# object replacement character where an attachment was inlined
+IGNORED_CHARACTERS = dict.fromkeys(map(ord, "\ufffc\u200b\u200d\ufeff"))
+QUOTES = str.maketrans("\u2018\u2019\u201c\u201d", "''\"\"")
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str | None) -> str:
+    if not text:
+        return ""
+
+    text = unicodedata.normalize("NFKC", text).translate(IGNORED_CHARACTERS)
+    text = text.translate(QUOTES)
+    return WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def address_key(address: str) -> str:
+    """
+    Compare phone numbers on their last 10 digits so "+1 (555) 123-4567"
+    and "5551234567" match. Emails and short codes are compared as-is.
+    """
+    digits = re.sub(r"\D", "", address)
+    if len(digits) >= 7 and not re.search(r"[A-Za-z@]", address):
+        return digits[-10:]
+
+    return address.strip().lower()
+
+
+@dataclass
+class Row:
+    id: int
+    seconds: float
+    conversation_id: int
+    direction: Direction
+    contact_id: int
+    text: str | None
+    media_count: int
+
+    @property
+    def has_subsecond_precision(self) -> bool:
+        return round(self.seconds * 1000) % 1000 != 0
+
+
+@dataclass
+class DuplicatePair:
+    keep: Row
+    duplicate: Row
+
+
+def is_repeat_send(a: Row, b: Row) -> bool:
+    """
+    Whether two matching messages came from the same export and were
+    genuinely sent twice. Timestamp precision alone can't tell: XML keeps
+    milliseconds for SMS but stores MMS in whole seconds, like CSV. The
+    exports also differ in how they write the same text (None vs "\ufffc",
+    quotes), so a repeat has exactly the same text, and messages with media
+    are always treated as copies.
+    """
+    return (
+        a.conversation_id == b.conversation_id
+        and a.has_subsecond_precision == b.has_subsecond_precision
+        and a.text == b.text
+        and not a.media_count
+        and not b.media_count
+    )
+
+
+def prefer(a: Row, b: Row) -> tuple[Row, Row]:
+    """Keep the copy with media, then the more precise timestamp, then the oldest row"""
+
+    def rank(row: Row):
+        return (row.media_count > 0, row.has_subsecond_precision, -row.id)
+
+    return (a, b) if rank(a) >= rank(b) else (b, a)
+
+
+def iter_rows(session: Session, batch_size: int = 10000):
+    """Messages in date order, streamed from the cursor rather than loaded at once"""
+    media_counts = (
+        select(Media.message_id, func.count(Media.id).label("media_count"))
+        .group_by(Media.message_id)
+        .subquery()
+    )
+
+    rows = session.exec(
+        select(
+            Message.id,
+            (func.julianday(Message.date) - UNIX_EPOCH_JULIANDAY) * 86400,
+            Message.conversation_id,
+            Message.direction,
+            Message.contact_id,
+            Message.text,
+            func.coalesce(media_counts.c.media_count, 0),
+        )
+        .outerjoin(media_counts, media_counts.c.message_id == Message.id)
+        .order_by(Message.date)
+        .execution_options(yield_per=batch_size)
+    )
+
+    for id, seconds, conversation_id, direction, contact_id, text, media_count in rows:
+        yield Row(
+            id=id,
+            seconds=round(seconds, 3),
+            conversation_id=conversation_id,
+            direction=direction,
+            contact_id=contact_id,
+            text=text,
+            media_count=media_count,
+        )
+
+
+def participant_keys(session: Session) -> dict[int, frozenset]:
+    contacts = dict(session.exec(select(Contact.id, Contact.address)).all())
+
+    participants = defaultdict(set)
+    for conversation_id, contact_id in session.exec(
+        select(
+            ConversationContactLink.conversation_id, ConversationContactLink.contact_id
+        )
+    ).all():
+        participants[conversation_id].add(address_key(contacts[contact_id]))
+
+    return {key: frozenset(value) for key, value in participants.items()}
+
+
+def find_duplicates(session: Session, window: float = 2.0) -> list[DuplicatePair]:
+    """
+    Match messages with the same normalized text, participants and sender
+    whose timestamps are within `window` seconds of each other.
+
+    Messages are hashed into `window`-wide time buckets, so each one is only
+    compared against the handful of messages in its own and neighbouring
+    buckets. Each message is matched at most once.
+    """
+    contacts = dict(session.exec(select(Contact.id, Contact.address)).all())
+    participants = participant_keys(session)
+
+    # Time bucket -> signature -> unmatched messages. Rows arrive in date
+    # order, so buckets more than one behind the current row can't match
+    # anything again and are dropped, keeping memory flat on large archives.
+    buckets: dict[int, dict[tuple, list[Row]]] = {}
+    pairs = []
+
+    for row in iter_rows(session):
+        sender = (
+            "me"
+            if row.direction == Direction.sent
+            else address_key(contacts[row.contact_id])
+        )
+        signature = (
+            normalize_text(row.text),
+            participants.get(row.conversation_id, frozenset()),
+            sender,
+        )
+        bucket = int(row.seconds // window)
+
+        for stale in [key for key in buckets if key < bucket - 1]:
+            del buckets[stale]
+
+        match = None
+        for candidate_bucket in (bucket - 1, bucket, bucket + 1):
+            for candidate in buckets.get(candidate_bucket, {}).get(signature, ()):
+                if abs(candidate.seconds - row.seconds) > window:
+                    continue
+
+                if is_repeat_send(candidate, row):
+                    continue
+
+                match = candidate
+                break
+
+            if match:
+                break
+
+        if match:
+            buckets[int(match.seconds // window)][signature].remove(match)
+            keep, duplicate = prefer(match, row)
+            pairs.append(DuplicatePair(keep=keep, duplicate=duplicate))
+        else:
+            buckets.setdefault(bucket, defaultdict(list))[signature].append(row)
+
+    return pairs
+
+
+def merge_duplicates(
+    session: Session, pairs: list[DuplicatePair], batch_size: int = 500
+):
+    """
+    Delete the duplicate of each pair along with its attachments. prefer()
+    keeps the copy with media, so a duplicate only has media when the kept
+    message has its own.
+    """
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start : start + batch_size]
+
+        duplicate_ids = [pair.duplicate.id for pair in batch]
+        orphaned = session.exec(
+            select(Media.file_path).where(
+                Media.message_id.in_(duplicate_ids), Media.file_path.is_not(None)
+            )
+        ).all()
+
+        session.execute(delete(Media).where(Media.message_id.in_(duplicate_ids)))
+        session.execute(delete(Message).where(Message.id.in_(duplicate_ids)))
+        session.commit()
+
+        for file_path in orphaned:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    bump_generation(session)
@@ -0,0 +1,54 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from .db import list_owners, owner_session, valid_owner
+
+# Reads across every owner's archive are off unless enabled, since they
+# expose everyone's messages to anyone who can reach the API
+FEDERATED_READS = os.environ.get("FEDERATED_READS", "") in ("1", "true", "yes")
+FEDERATED_WORKERS = int(os.environ.get("FEDERATED_WORKERS", 4))
+
+_executor = ThreadPoolExecutor(
+    max_workers=FEDERATED_WORKERS, thread_name_prefix="federated"
+)
+
+
+def federated_owners(owners: str | None) -> list[str]:
+    """Owners named in a comma separated `owners` parameter, or all of them"""
+    if not FEDERATED_READS:
+        raise HTTPException(status_code=404, detail="Federated reads are disabled")
+
+    available = list_owners()
+    if not owners:
+        return available
+
+    requested = [owner.strip() for owner in owners.split(",") if owner.strip()]
+    for owner in requested:
+        if not valid_owner(owner) or owner not in available:
+            raise HTTPException(status_code=404, detail=f"Owner {owner} not found")
+
+    return requested
+
+
+def run_for_owner(owner: str, query):
+    with owner_session(owner) as session:
+        return query(session)
+
+
+def fan_out(owners: list[str], query) -> tuple[dict, dict]:
+    """
+    Run `query(session)` against each owner's database concurrently. Returns
+    the results by owner, and the errors of owners whose query failed so
+    one broken database doesn't fail the whole read.
+    """
+    futures = {owner: _executor.submit(run_for_owner, owner, query) for owner in owners}
+
+    results, errors = {}, {}
+    for owner, future in futures.items():
+        try:
+            results[owner] = future.result()
+        except Exception as e:
+            print(f"Federated read failed for {owner}: {e}")
+            errors[owner] = str(e)
+
+    return results, errors
@@ -1,15 +1,28 @@
 from fastapi import FastAPI
-from sqlmodel import SQLModel
 from contextlib import asynccontextmanager
-from .db import engine
+from .db import add_engine_hook, get_engine
+from .profiling import (
+    install_sql_tracing,
+    profile_requests,
+    profiled_startup,
+    startup_report,
+)
+from .warmup import start_warmup
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    SQLModel.metadata.create_all(engine)
+    with profiled_startup():
+        # Other owners' databases are opened and upgraded on first use
+        with startup_report.phase("schema"):
+            get_engine()
+
+    start_warmup()
     yield
     # shutdown code here
 
 
 app = FastAPI(lifespan=lifespan)
+app.middleware("http")(profile_requests)
+add_engine_hook(install_sql_tracing)
@@ -0,0 +1,347 @@
+import fcntl
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from .packstore import PackReader, get_pack_reader
+from .utils import HEADER_BYTES, image_dimensions
+
+BATCH_SIZE = 5000
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    # Called with the engine, the migration's version and the batch size
+    apply: Callable[[Engine, int, int], None]
+    # Steps that build indexes or rewrite rows leave the planner's
+    # statistics out of date
+    analyze: bool = False
+
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(
+        row[1] == column for row in conn.execute(text(f'PRAGMA table_info("{table}")'))
+    )
+
+
+def add_columns(engine: Engine, table: str, columns: dict[str, str]):
+    """Add nullable columns that aren't there yet, new databases already have them"""
+    with engine.begin() as conn:
+        for column, column_type in columns.items():
+            if not has_column(conn, table, column):
+                conn.execute(
+                    text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {column_type}')
+                )
+
+
+def create_index(engine: Engine, name: str, table: str, columns: list[str]):
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({", ".join(columns)})'
+            )
+        )
+
+
+def get_progress(engine: Engine, version: int) -> int:
+    with engine.begin() as conn:
+        position = conn.execute(
+            text("SELECT position FROM schema_migration_progress WHERE version = :v"),
+            {"v": version},
+        ).scalar()
+
+    return position or 0
+
+
+def set_progress(conn: Connection, version: int, position: int):
+    conn.execute(
+        text(
+            "INSERT INTO schema_migration_progress (version, position) "
+            "VALUES (:v, :p) ON CONFLICT (version) DO UPDATE SET position = :p"
+        ),
+        {"v": version, "p": position},
+    )
+
+
+def run_batches(engine: Engine, version: int, batch_size: int, step):
+    """
+    Call `step(conn, after_id, batch_size)` until it returns None, each call
+    in its own transaction. `step` returns the last id it handled, which is
+    saved so an interrupted migration picks up where it stopped.
+    """
+    position = get_progress(engine, version)
+    started = time.monotonic()
+    batches = 0
+
+    while True:
+        with engine.begin() as conn:
+            last_id = step(conn, position, batch_size)
+            if last_id is None:
+                break
+
+            set_progress(conn, version, last_id)
+
+        position = last_id
+        batches += 1
+        if batches % 20 == 0:
+            print(f"  ... up to id {position} ({time.monotonic() - started:.0f}s)")
+
+
+def media_pack_columns(engine: Engine, version: int, batch_size: int):
+    add_columns(
+        engine,
+        "media",
+        {"pack_segment": "INTEGER", "pack_offset": "INTEGER", "pack_length": "INTEGER"},
+    )
+
+
+def media_index_columns(engine: Engine, version: int, batch_size: int):
+    add_columns(
+        engine,
+        "media",
+        {
+            "conversation_id": "INTEGER REFERENCES conversation (id)",
+            "date": "DATETIME",
+            "kind": "VARCHAR(5)",
+            "width": "INTEGER",
+            "height": "INTEGER",
+        },
+    )
+
+
+def media_index_backfill(engine: Engine, version: int, batch_size: int):
+    """Copy conversation, date and kind onto media imported before they existed"""
+
+    def step(conn: Connection, after_id: int, batch_size: int):
+        last_id = conn.execute(
+            text(
+                "SELECT max(id) FROM (SELECT id FROM media WHERE id > :after "
+                "ORDER BY id LIMIT :limit)"
+            ),
+            {"after": after_id, "limit": batch_size},
+        ).scalar()
+        if last_id is None:
+            return None
+
+        conn.execute(
+            text("""
+                UPDATE media SET
+                    conversation_id = (
+                        SELECT conversation_id FROM message
+                        WHERE message.id = media.message_id
+                    ),
+                    date = (
+                        SELECT date FROM message WHERE message.id = media.message_id
+                    ),
+                    kind = CASE
+                        WHEN content_type LIKE 'image/%' THEN 'image'
+                        WHEN content_type LIKE 'video/%' THEN 'video'
+                        WHEN content_type LIKE 'audio/%' THEN 'audio'
+                        ELSE 'other'
+                    END
+                WHERE id > :after AND id <= :last AND conversation_id IS NULL
+                """),
+            {"after": after_id, "last": last_id},
+        )
+        return last_id
+
+    run_batches(engine, version, batch_size, step)
+
+
+def media_indexes(engine: Engine, version: int, batch_size: int):
+    create_index(engine, "ix_media_message_id", "media", ["message_id"])
+    create_index(
+        engine, "ix_media_conversation_date", "media", ["conversation_id", "date", "id"]
+    )
+    create_index(
+        engine,
+        "ix_media_conversation_kind_date",
+        "media",
+        ["conversation_id", "kind", "date", "id"],
+    )
+
+
+def message_indexes(engine: Engine, version: int, batch_size: int):
+    create_index(
+        engine, "ix_message_conversation_date", "message", ["conversation_id", "date"]
+    )
+    create_index(
+        engine,
+        "ix_conversationcontactlink_contact_id",
+        "conversationcontactlink",
+        ["contact_id"],
+    )
+
+
+def read_header(
+    reader: PackReader, file_path, pack_segment, pack_offset, pack_length
+) -> bytes | None:
+    if pack_segment is not None:
+        return reader.read(pack_segment, pack_offset, pack_length, 0, HEADER_BYTES - 1)
+
+    try:
+        with Path(file_path).open("rb") as f:
+            return f.read(HEADER_BYTES)
+    except (OSError, TypeError):
+        return None
+
+
+def media_dimensions_backfill(engine: Engine, version: int, batch_size: int):
+    """Read image sizes from the headers of media imported before they were kept"""
+    # Packs live next to the database they belong to, see db.pack_dir()
+    reader = get_pack_reader(Path(engine.url.database).parent / "media" / "packs")
+
+    def step(conn: Connection, after_id: int, batch_size: int):
+        rows = conn.execute(
+            text(
+                "SELECT id, file_path, pack_segment, pack_offset, pack_length "
+                "FROM media WHERE id > :after AND kind = 'image' AND width IS NULL "
+                "ORDER BY id LIMIT :limit"
+            ),
+            # Reading files is far slower than updating rows
+            {"after": after_id, "limit": max(batch_size // 10, 1)},
+        ).all()
+        if not rows:
+            return None
+
+        for media_id, *location in rows:
+            header = read_header(reader, *location)
+            dimensions = image_dimensions(header) if header else None
+            if dimensions:
+                conn.execute(
+                    text("UPDATE media SET width = :w, height = :h WHERE id = :id"),
+                    {"w": dimensions[0], "h": dimensions[1], "id": media_id},
+                )
+
+        return rows[-1][0]
+
+    run_batches(engine, version, batch_size, step)
+
+
+MIGRATIONS = [
+    Migration(1, "media pack columns", media_pack_columns),
+    Migration(2, "media index columns", media_index_columns),
+    Migration(3, "media index backfill", media_index_backfill, analyze=True),
+    Migration(4, "media indexes", media_indexes, analyze=True),
+    Migration(5, "message indexes", message_indexes, analyze=True),
+    Migration(6, "media dimensions backfill", media_dimensions_backfill),
+]
+
+# Stored in PRAGMA user_version once a database is fully upgraded, so
+# startup can skip create_all() and the migration checks. That makes
+# create_all() only run when this changes, so adding a table needs a
+# migration too, even one that does nothing.
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def ensure_migration_tables(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations "
+                "(version INTEGER PRIMARY KEY, name TEXT, applied_at DATETIME)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_migration_progress "
+                "(version INTEGER PRIMARY KEY, position INTEGER)"
+            )
+        )
+
+
+def schema_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+@contextmanager
+def migration_lock(engine: Engine):
+    """
+    Held while a database is upgraded. The web app and the watcher both
+    upgrade at container start, and would otherwise apply the same
+    migrations at the same time.
+    """
+    with open(f"{engine.url.database}.migrate.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def applied_versions(engine: Engine) -> set[int]:
+    ensure_migration_tables(engine)
+    with engine.begin() as conn:
+        return set(
+            conn.execute(text("SELECT version FROM schema_migrations")).scalars()
+        )
+
+
+def optimize(engine: Engine, analyze: bool = False):
+    """
+    Refresh the statistics the query planner uses, after migrations and
+    imports. analysis_limit keeps a full ANALYZE down to milliseconds on
+    large archives by sampling each index.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("PRAGMA analysis_limit = 1000"))
+        if analyze:
+            conn.execute(text("ANALYZE"))
+        conn.execute(text("PRAGMA optimize"))
+
+
+def migrate(
+    engine: Engine,
+    batch_size: int = BATCH_SIZE,
+    verbose: bool = True,
+    new_database: bool = False,
+):
+    """
+    Apply every migration that hasn't run against this database yet. A new
+    database was just created at the latest schema by create_all(), so its
+    migrations are only recorded.
+    """
+    applied = applied_versions(engine)
+    needs_analyze = False
+    verbose = verbose and not new_database
+
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+
+        if verbose:
+            print(f"Applying migration {migration.version}: {migration.name}")
+        started = time.monotonic()
+
+        if not new_database:
+            migration.apply(engine, migration.version, batch_size)
+
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) "
+                    "VALUES (:v, :n, :t)"
+                ),
+                {"v": migration.version, "n": migration.name, "t": datetime.now()},
+            )
+            conn.execute(
+                text("DELETE FROM schema_migration_progress WHERE version = :v"),
+                {"v": migration.version},
+            )
+
+        needs_analyze = needs_analyze or migration.analyze
+        if verbose:
+            print(f"  done in {time.monotonic() - started:.1f}s")
+
+    if not new_database:
+        optimize(engine, analyze=needs_analyze)
+
+    with engine.begin() as conn:
+        conn.execute(text(f"PRAGMA user_version = {LATEST_VERSION}"))
@@ -1,3 +1,4 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
 from datetime import datetime
@@ -16,7 +17,7 @@ class Direction(str, Enum):
 
 class ConversationContactLink(SQLModel, table=True):
     conversation_id: int = Field(foreign_key="conversation.id", primary_key=True)
-    contact_id: int = Field(foreign_key="contact.id", primary_key=True)
+    contact_id: int = Field(foreign_key="contact.id", primary_key=True, index=True)
 
 
 class Conversation(SQLModel, table=True):
@@ -40,6 +41,11 @@ class Contact(SQLModel, table=True):
 
 
 class Message(SQLModel, table=True):
+    __table_args__ = (
+        # Message pages and their cursors, within a conversation by date
+        Index("ix_message_conversation_date", "conversation_id", "date"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     date: datetime
     type: MessageType
@@ -55,11 +61,57 @@ class Message(SQLModel, table=True):
     media: List["Media"] = Relationship(back_populates="message")
 
 
+class MediaKind(str, Enum):
+    image = "image"
+    video = "video"
+    audio = "audio"
+    other = "other"
+
+
 class Media(SQLModel, table=True):
+    __table_args__ = (
+        # Gallery paging, newest first, optionally filtered by kind
+        Index("ix_media_conversation_date", "conversation_id", "date", "id"),
+        Index(
+            "ix_media_conversation_kind_date", "conversation_id", "kind", "date", "id"
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    message_id: int = Field(foreign_key="message.id")
+    message_id: int = Field(foreign_key="message.id", index=True)
     content_type: Optional[str] = None
     filename: Optional[str] = None
     file_path: Optional[str] = None
 
+    # Copied from the message so the gallery doesn't need to join it
+    conversation_id: Optional[int] = Field(default=None, foreign_key="conversation.id")
+    date: Optional[datetime] = None
+    kind: Optional[MediaKind] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    # Set instead of file_path when the attachment lives in a pack segment
+    pack_segment: Optional[int] = None
+    pack_offset: Optional[int] = None
+    pack_length: Optional[int] = None
+
     message: Optional["Message"] = Relationship(back_populates="media")
+
+
+class IngestedArchive(SQLModel, table=True):
+    """Backups imported by the watch folder, so unchanged files are skipped"""
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    path: str = Field(index=True)
+    sha256: str = Field(unique=True, index=True)
+    size: int
+    mtime: float
+    ingested_at: datetime
+
+
+class DataGeneration(SQLModel, table=True):
+    """Single row counter bumped whenever an import changes the archive"""
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    generation: int = 0
+    updated_at: Optional[datetime] = None
@@ -0,0 +1,147 @@
+import fcntl
+import mmap
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Optional
+
+PACK_DIR = Path("/data/media/packs")
+SEGMENT_MAX_BYTES = int(os.environ.get("MEDIA_PACK_SEGMENT_BYTES", 1024**3))
+
+# "files" keeps the original one-file-per-part layout, "pack" appends new
+# attachments to segment files instead.
+MEDIA_BACKEND = os.environ.get("MEDIA_BACKEND", "files")
+
+SEGMENT_PATTERN = re.compile(r"^segment-(\d+)\.pack$")
+
+
+def packs_enabled() -> bool:
+    return MEDIA_BACKEND == "pack"
+
+
+def segment_path(segment: int, pack_dir: Path = PACK_DIR) -> Path:
+    return pack_dir / f"segment-{segment:06d}.pack"
+
+
+def list_segments(pack_dir: Path = PACK_DIR) -> list[int]:
+    if not pack_dir.exists():
+        return []
+
+    segments = []
+    for file in pack_dir.iterdir():
+        match = SEGMENT_PATTERN.match(file.name)
+        if match:
+            segments.append(int(match.group(1)))
+
+    return sorted(segments)
+
+
+class PackWriter:
+    """
+    Appends blobs to the newest segment file, rolling over to a new segment
+    once it reaches `max_bytes`. Appends take an exclusive lock on the segment
+    so an importer and the compaction tool can't interleave writes.
+    """
+
+    def __init__(self, pack_dir: Path = PACK_DIR, max_bytes: int = SEGMENT_MAX_BYTES):
+        self.pack_dir = pack_dir
+        self.max_bytes = max_bytes
+        self.pack_dir.mkdir(parents=True, exist_ok=True)
+
+        segments = list_segments(self.pack_dir)
+        self.segment = segments[-1] if segments else 1
+        self.file = None
+
+    def _open(self):
+        if self.file is None:
+            self.file = open(segment_path(self.segment, self.pack_dir), "ab")
+        return self.file
+
+    def append(self, data: bytes) -> tuple[int, int, int]:
+        """Write `data` and return its (segment, offset, length)"""
+        f = self._open()
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            offset = f.seek(0, os.SEEK_END)
+            if offset > 0 and offset + len(data) > self.max_bytes:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                self.close()
+                self.segment = max(list_segments(self.pack_dir) + [self.segment]) + 1
+                return self.append(data)
+
+            f.write(data)
+            # Readers in other processes map the file directly, so the bytes
+            # must reach the OS before the Media row is committed.
+            f.flush()
+        finally:
+            if not f.closed:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        return self.segment, offset, len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+
+
+class PackReader:
+    """
+    Serves byte ranges out of memory-mapped segments. Maps are opened once
+    and kept for the life of the process; a segment that has grown since it
+    was mapped is re-mapped the first time a range past its end is requested.
+    """
+
+    def __init__(self, pack_dir: Path = PACK_DIR):
+        self.pack_dir = pack_dir
+        self.maps: dict[int, mmap.mmap] = {}
+        self.lock = threading.Lock()
+
+    def _map(self, segment: int, needed: int) -> Optional[mmap.mmap]:
+        with self.lock:
+            mapped = self.maps.get(segment)
+            if mapped is not None and len(mapped) >= needed:
+                return mapped
+
+            try:
+                with open(segment_path(segment, self.pack_dir), "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if size < needed:
+                        return None
+                    new_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                return None
+
+            # Old maps may still be referenced by in-flight responses, so let
+            # them be garbage collected rather than closing them here.
+            self.maps[segment] = new_map
+            return new_map
+
+    def read(
+        self, segment: int, offset: int, length: int, start: int = 0, end: int = None
+    ) -> Optional[bytes]:
+        """Return bytes `start`..`end` (inclusive) of the blob, or None if missing"""
+        end = length - 1 if end is None else min(end, length - 1)
+        mapped = self._map(segment, offset + length)
+        if mapped is None:
+            return None
+
+        return mapped[offset + start : offset + end + 1]
+
+
+pack_reader = PackReader()
+_pack_readers = {PACK_DIR: pack_reader}
+_pack_readers_lock = threading.Lock()
+
+
+def get_pack_reader(pack_dir: Path = PACK_DIR) -> PackReader:
+    """Shared reader for a pack directory, so its maps are reused"""
+    with _pack_readers_lock:
+        reader = _pack_readers.get(pack_dir)
+        if reader is None:
+            reader = _pack_readers[pack_dir] = PackReader(pack_dir)
+
+        return reader
@@ -4,12 +4,13 @@ import mimetypes
 import re
 import os
 import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional
 from datetime import datetime
 from pathlib import Path
 from sqlmodel import Session, select
-from lxml import etree
-from sqlalchemy import func
+from sqlalchemy import func, insert, tuple_
 from .models import (
     Message,
     Contact,
@@ -19,14 +20,74 @@ from .models import (
     Conversation,
     ConversationContactLink,
 )
-from .utils import normalize_number
+from .csv_chunks import Row, find_chunks, parse_chunk, read_header
+from .db import bump_generation, media_dir, pack_dir, session_owner
+from .packstore import PackWriter, packs_enabled
+from .utils import HEADER_BYTES, image_dimensions, media_kind, normalize_number
 
-MEDIA_DIR = Path("/data/media")
-MEDIA_DIR.mkdir(exist_ok=True)
+# Messages written per transaction by the parallel CSV import
+BULK_INSERT_ROWS = 5000
 
 
 class Parser:
     session: Session
+    _pack_writer: Optional[PackWriter] = None
+
+    @property
+    def media_dir(self) -> Path:
+        """Media root of the owner whose database the session is bound to"""
+        return media_dir(session_owner(self.session))
+
+    @property
+    def pack_writer(self) -> PackWriter:
+        if self._pack_writer is None:
+            self._pack_writer = PackWriter(pack_dir(session_owner(self.session)))
+
+        return self._pack_writer
+
+    def media_index(self, message: Message, content_type: str, header: bytes) -> dict:
+        """Gallery columns copied onto each Media row"""
+        width, height = image_dimensions(header) or (None, None)
+        return {
+            "message_id": message.id,
+            "conversation_id": message.conversation_id,
+            "date": message.date,
+            "kind": media_kind(content_type),
+            "width": width,
+            "height": height,
+        }
+
+    def store_media(
+        self, data: bytes, message: Message, content_type: str, filename: str
+    ) -> Media:
+        """Write attachment bytes to the configured media backend"""
+        index = self.media_index(message, content_type, data[:HEADER_BYTES])
+
+        if packs_enabled():
+            segment, offset, length = self.pack_writer.append(data)
+            return Media(
+                content_type=content_type,
+                filename=filename,
+                pack_segment=segment,
+                pack_offset=offset,
+                pack_length=length,
+                **index,
+            )
+
+        filepath = self.media_dir / filename
+        with open(filepath, "wb") as f:
+            f.write(data)
+
+        return Media(
+            content_type=content_type,
+            filename=filename,
+            file_path=str(filepath),
+            **index,
+        )
+
+    def close(self):
+        if self._pack_writer is not None:
+            self._pack_writer.close()
 
     def get_or_create_contact(
         self, address: str, name: Optional[str] = None
@@ -96,7 +157,7 @@ class Parser:
 
             return convo
 
-        new_convo = Conversation()
+        new_convo = Conversation(name=conversation_name)
         self.session.add(new_convo)
         self.session.commit()  # Must commit first to get an ID
 
@@ -117,30 +178,21 @@ class SMSBackupAndRestore(Parser):
     def __init__(self, session: Session):
         self.session = session
 
-    def save_media(self, part_elem, message_id: str, index: int) -> Optional[Media]:
+    def save_media(self, part_elem, message: Message, index: int) -> Optional[Media]:
         ct = part_elem.attrib.get("ct")
         data = part_elem.attrib.get("data")
         if not data:
             return None
 
         ext = ct.split("/")[-1]
-        filename = f"{message_id}_{index}.{ext}"
-        filepath = MEDIA_DIR / filename
+        filename = f"{message.id}_{index}.{ext}"
 
         try:
-            with open(filepath, "wb") as f:
-                f.write(base64.b64decode(data))
+            return self.store_media(base64.b64decode(data), message, ct, filename)
         except (base64.binascii.Error, ValueError) as e:
             print(f"Failed to decode media part: {e}")
             return None
 
-        return Media(
-            message_id=message_id,
-            content_type=ct,
-            filename=filename,
-            file_path=str(filepath),
-        )
-
     def process_sms(self, elem, user_address: str):
         date_ts = int(elem.attrib["date"])
         address = elem.attrib.get("address")
@@ -262,11 +314,14 @@ class SMSBackupAndRestore(Parser):
         self.session.refresh(msg)
 
         for index, part in enumerate(media_parts):
-            media = self.save_media(part, msg.id, index)
+            media = self.save_media(part, msg, index)
             if media:
                 self.session.add(media)
 
     def parse_sms_xml_stream(self, filepath: str, user_address: str = None):
+        # Only XML imports need lxml, CSV imports and the web app skip loading it
+        from lxml import etree
+
         context = etree.iterparse(
             filepath, events=("end",), tag=("sms", "mms"), huge_tree=True
         )
@@ -286,7 +341,9 @@ class SMSBackupAndRestore(Parser):
             while elem.getprevious() is not None:
                 del elem.getparent()[0]
 
+        self.close()
         self.session.commit()
+        bump_generation(self.session)
 
 
 class CSV(Parser):
@@ -354,25 +411,36 @@ class CSV(Parser):
         return mime_type or "application/octet-stream"
 
     def save_media(
-        self, attachment_path, message_id: str, index: int
+        self, attachment_path, message: Message, index: int
     ) -> Optional[Media]:
         ct = self._guess_content_type(attachment_path) if attachment_path else None
 
         ext = os.path.splitext(attachment_path)[1]
-        filename = f"{message_id}_{index}{ext}"
-        filepath = MEDIA_DIR / filename
+        filename = f"{message.id}_{index}{ext}"
+
+        if packs_enabled():
+            try:
+                data = Path(attachment_path).read_bytes()
+                return self.store_media(data, message, ct, filename)
+            except Exception as e:
+                print(f"Failed to pack media: {e}")
+                return None
+
+        filepath = self.media_dir / filename
 
         try:
             shutil.copy2(attachment_path, filepath)
+            with open(filepath, "rb") as f:
+                header = f.read(HEADER_BYTES)
         except Exception as e:
             print(f"Failed to copy media: {e}")
             return None
 
         return Media(
-            message_id=message_id,
             content_type=ct,
             filename=filename,
             file_path=str(filepath),
+            **self.media_index(message, ct, header),
         )
 
     def parse(self, user_address: str):
@@ -415,8 +483,126 @@ class CSV(Parser):
                 self.session.refresh(message)
 
                 for index, attachment in enumerate(attachments):
-                    media = self.save_media(attachment, message.id, index)
+                    media = self.save_media(attachment, message, index)
                     if media:
                         self.session.add(media)
 
+        self.close()
+        self.session.commit()
+        bump_generation(self.session)
+
+    def parse_parallel(self, user_address: str, workers: int):
+        """
+        Import the same messages as parse(), with rows parsed by `workers`
+        processes that each take a byte range of the file. This process
+        resolves contacts and conversations and bulk inserts the rows in
+        file order.
+        """
+        me = self.get_or_create_contact(user_address, "Me")
+        self.contacts: dict[str, Contact] = {}
+        self.conversation_ids: dict[int, int] = {}
+
+        path = str(self.filepath)
+        fieldnames, start = read_header(path)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for chunk_start, chunk_end in find_chunks(path, start):
+                pending.append(
+                    executor.submit(
+                        parse_chunk, path, chunk_start, chunk_end, fieldnames
+                    )
+                )
+                # Don't let parsed rows pile up faster than they're written
+                if len(pending) > workers * 2:
+                    self.write_rows(pending.popleft().result(), me)
+
+            while pending:
+                self.write_rows(pending.popleft().result(), me)
+
+        self.close()
+        self.session.commit()
+        bump_generation(self.session)
+
+    def resolve_contact(self, row: Row) -> Contact:
+        contact = self.contacts.get(row.normalized_address)
+        if contact is None or (row.name and not contact.name):
+            contact = self.get_or_create_contact(row.address, row.name)
+            self.contacts[row.normalized_address] = contact
+            # A new name renames the conversation
+            self.conversation_ids.pop(contact.id, None)
+
+        return contact
+
+    def resolve_conversation_id(self, contact: Contact) -> int:
+        conversation_id = self.conversation_ids.get(contact.id)
+        if conversation_id is None:
+            conversation_id = self.get_or_create_conversation([contact]).id
+            self.conversation_ids[contact.id] = conversation_id
+
+        return conversation_id
+
+    def write_rows(self, rows: list[Row], me: Contact):
+        for start in range(0, len(rows), BULK_INSERT_ROWS):
+            self.insert_batch(rows[start : start + BULK_INSERT_ROWS], me)
+
+    def insert_batch(self, rows: list[Row], me: Contact):
+        resolved = []
+        for row in rows:
+            contact = self.resolve_contact(row)
+            resolved.append((row, contact, self.resolve_conversation_id(contact)))
+
+        # Dedupe against earlier imports and batches with one query, and
+        # within the batch as we go
+        dates = {(conversation_id, row.date) for row, _, conversation_id in resolved}
+        existing = {
+            tuple(message)
+            for message in self.session.exec(
+                select(Message.conversation_id, Message.date, Message.text).where(
+                    tuple_(Message.conversation_id, Message.date).in_(dates)
+                )
+            )
+        }
+
+        values = []
+        attachments = []
+        for row, contact, conversation_id in resolved:
+            key = (conversation_id, row.date, row.text)
+            if key in existing:
+                continue
+
+            existing.add(key)
+            row_attachments = self.attachment_index.get(row.date_key, [])
+            values.append(
+                {
+                    "date": row.date,
+                    "type": MessageType.mms if row_attachments else MessageType.sms,
+                    "direction": Direction.sent if row.sent else Direction.inbox,
+                    "text": row.text,
+                    "contact_id": me.id if row.sent else contact.id,
+                    "conversation_id": conversation_id,
+                }
+            )
+            attachments.append(row_attachments)
+
+        if not values:
+            return
+
+        message_ids = self.session.scalars(
+            insert(Message).returning(Message.id, sort_by_parameter_order=True),
+            values,
+        ).all()
+
+        for message_id, message_values, message_attachments in zip(
+            message_ids, values, attachments
+        ):
+            if not message_attachments:
+                continue
+
+            message = Message(id=message_id, **message_values)
+            for index, attachment in enumerate(message_attachments):
+                media = self.save_media(attachment, message, index)
+                if media:
+                    self.session.add(media)
+
         self.session.commit()
@@ -0,0 +1,258 @@
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", "/data/profiles"))
+# Profile every request, otherwise only requests sending X-Profile with the
+# admin token are profiled
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "") in ("1", "true", "yes")
+PROFILE_ADMIN_TOKEN = os.environ.get("PROFILE_ADMIN_TOKEN")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 200))
+# Sample app startup and write it as a profile named "startup"
+PROFILE_STARTUP = os.environ.get("PROFILE_STARTUP", "") in ("1", "true", "yes")
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
+
+current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    def __init__(self, name: str, **info):
+        self.name = name
+        self.info = info
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.queries: list[dict] = []
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        # Threads doing this trace's work, the only ones sampled
+        self.threads: set[int] = set()
+        self.lock = threading.Lock()
+
+    def add_thread(self):
+        self.threads.add(threading.get_ident())
+
+    def add_query(self, statement: str, parameters, duration: float, rows: int):
+        with self.lock:
+            self.queries.append(
+                {
+                    "statement": statement,
+                    "parameters": repr(parameters)[:500],
+                    "duration_ms": round(duration * 1000, 3),
+                    "rows": rows,
+                }
+            )
+
+    def to_dict(self) -> dict:
+        sql_time = sum(query["duration_ms"] for query in self.queries)
+        return {
+            "name": self.name,
+            **self.info,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "sql_count": len(self.queries),
+            "sql_ms": round(sql_time, 3),
+            "queries": self.queries,
+            "sample_interval_ms": SAMPLE_INTERVAL * 1000,
+            "samples": self.samples,
+            # Collapsed "outer;inner" stacks, usable with flamegraph tools
+            "stacks": dict(self.stacks.most_common()),
+        }
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample(trace: Trace, stop: threading.Event):
+    """
+    Record the stacks of the trace's threads until `stop` is set. Sync
+    endpoints run in a worker thread, which joins the trace when it first
+    runs SQL under it, so other requests and the event loop stay out.
+    """
+    while not stop.wait(SAMPLE_INTERVAL):
+        frames = sys._current_frames()
+        for thread_id in list(trace.threads):
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            trace.stacks[";".join(reversed(stack))] += 1
+
+        trace.samples += 1
+
+
+def write_trace(trace: Trace) -> Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", trace.name).strip("-")[:80]
+    path = PROFILE_DIR / f"{trace.started_at:%Y%m%d-%H%M%S-%f}-{slug}.json"
+    path.write_text(json.dumps(trace.to_dict(), indent=2, default=str))
+
+    # Keep the directory from growing without bound
+    profiles = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for old in profiles[:-PROFILE_KEEP]:
+        old.unlink(missing_ok=True)
+
+    return path
+
+
+@contextmanager
+def profiled(name: str, sample_caller: bool = True, **info):
+    """
+    Sample stacks and record SQL for everything run inside the block. With
+    `sample_caller` the calling thread is sampled from the start, otherwise
+    only threads that run SQL under the trace are.
+    """
+    trace = Trace(name, **info)
+    if sample_caller:
+        trace.add_thread()
+    token = current_trace.set(trace)
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample, args=(trace, stop), daemon=True)
+    sampler.start()
+
+    try:
+        yield trace
+    finally:
+        trace.duration = time.perf_counter() - trace.started
+        stop.set()
+        sampler.join()
+        current_trace.reset(token)
+        trace.info["output"] = str(write_trace(trace))
+
+
+def install_sql_tracing(engine):
+    """Record every statement run on `engine` while a trace is active"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_thread()
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        trace = current_trace.get()
+        if trace is None or not conn.info.get("query_started"):
+            return
+
+        duration = time.perf_counter() - conn.info["query_started"].pop()
+        trace.add_query(statement, parameters, duration, cursor.rowcount)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def count_selected_rows(orm_execute_state):
+    """
+    SQLite reports a rowcount of -1 for SELECTs, so while tracing, ORM
+    selects are buffered to count their rows. The statement is the first
+    one recorded after this point, relationship loads may follow it.
+    """
+    trace = current_trace.get()
+    if trace is None or not orm_execute_state.is_select:
+        return None
+
+    trace.add_thread()
+    index = len(trace.queries)
+    frozen = orm_execute_state.invoke_statement().freeze()
+    if index < len(trace.queries):
+        trace.queries[index]["rows"] = len(frozen.data)
+
+    return frozen()
+
+
+class StartupReport:
+    """Time spent in each phase of starting the app"""
+
+    def __init__(self):
+        self.phases: list[tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def summary(self) -> str:
+        total = sum(seconds for _, seconds in self.phases)
+        phases = ", ".join(
+            f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases
+        )
+        return f"Started in {total * 1000:.0f}ms ({phases})"
+
+
+startup_report = StartupReport()
+
+
+@contextmanager
+def profiled_startup():
+    """Profile the startup work run inside the block when PROFILE_STARTUP is set"""
+    if not PROFILE_STARTUP:
+        yield
+        print(startup_report.summary())
+        return
+
+    with profiled("startup") as trace:
+        yield
+        trace.info["phases_ms"] = {
+            name: round(seconds * 1000, 3) for name, seconds in startup_report.phases
+        }
+
+    print(startup_report.summary())
+    print(f"Startup profile written to {trace.info['output']}")
+
+
+def profile_requested(request: Request) -> bool:
+    if PROFILE_REQUESTS:
+        return True
+
+    return (
+        PROFILE_ADMIN_TOKEN is not None
+        and request.headers.get("x-profile") == "1"
+        and hmac.compare_digest(
+            request.headers.get("x-profile-token", ""), PROFILE_ADMIN_TOKEN
+        )
+    )
+
+
+async def profile_requests(request: Request, call_next):
+    """HTTP middleware writing a profile of each requested request"""
+    if not profile_requested(request):
+        return await call_next(request)
+
+    # This runs on the event loop, which every request shares
+    with profiled(
+        f"{request.method} {request.url.path}",
+        sample_caller=False,
+        method=request.method,
+        path=request.url.path,
+        query=request.url.query,
+    ) as trace:
+        response = await call_next(request)
+        trace.info["status"] = response.status_code
+
+    response.headers["X-Profile-Output"] = Path(trace.info["output"]).name
+    return response
@@ -1,6 +1,10 @@
 import hashlib
 import re
-from .models import Message
+import struct
+from .models import Message, MediaKind
+
+# Enough of a file to find image dimensions in its header
+HEADER_BYTES = 64 * 1024
 
 
 def normalize_number(number: str):
@@ -18,3 +22,41 @@ def normalize_number(number: str):
     number = re.sub(r"^1", r"", number)
 
     return number.strip()
+
+
+def media_kind(content_type: str | None) -> MediaKind:
+    prefix = (content_type or "").split("/")[0].lower()
+    if prefix in ("image", "video", "audio"):
+        return MediaKind(prefix)
+
+    return MediaKind.other
+
+
+def image_dimensions(data: bytes) -> tuple[int, int] | None:
+    """Read width and height from the header of a PNG, GIF or JPEG"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+
+    if data[:2] == b"\xff\xd8":
+        # Walk the JPEG segments until a start-of-frame marker
+        offset = 2
+        while offset + 9 <= len(data):
+            if data[offset] != 0xFF:
+                return None
+
+            marker = data[offset + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                offset += 2
+                continue
+
+            length = struct.unpack(">H", data[offset + 2 : offset + 4])[0]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+                return width, height
+
+            offset += 2 + length
+
+    return None
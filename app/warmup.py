@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from .db import get_engine, list_owners
+
+# Read the hot indexes and newest conversations of every owner in the
+# background after startup, so the first requests after a restart don't
+# wait on a cold disk
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "") in ("1", "true", "yes")
+WARMUP_CONVERSATIONS = int(os.environ.get("WARMUP_CONVERSATIONS", 20))
+WARMUP_MESSAGES = 100
+WARMUP_MEDIA = 50
+
+# Indexes behind the conversation list, message pages and media gallery,
+# with a column each so SQLite scans the index itself
+HOT_INDEXES = [
+    ("message", "ix_message_conversation_date", "date"),
+    ("media", "ix_media_conversation_date", "date"),
+    ("media", "ix_media_conversation_kind_date", "kind"),
+    ("conversationcontactlink", "ix_conversationcontactlink_contact_id", "contact_id"),
+]
+# Small tables read in full by the conversation list
+HOT_TABLES = ["conversation", "contact", "conversationcontactlink"]
+
+
+def warm_indexes(conn: Connection):
+    for table, index, column in HOT_INDEXES:
+        conn.execute(
+            text(f'SELECT count("{column}") FROM "{table}" INDEXED BY "{index}"')
+        ).scalar()
+
+    for table in HOT_TABLES:
+        conn.execute(text(f'SELECT * FROM "{table}"')).fetchall()
+
+
+def recent_conversation_ids(conn: Connection, limit: int) -> list[int]:
+    return list(
+        conn.execute(
+            text(
+                "SELECT conversation_id FROM message GROUP BY conversation_id "
+                "ORDER BY max(date) DESC LIMIT :limit"
+            ),
+            {"limit": limit},
+        ).scalars()
+    )
+
+
+def warm_conversation(conn: Connection, conversation_id: int):
+    """Read the pages the UI opens first, and look up their media files"""
+    conn.execute(
+        text(
+            "SELECT * FROM message WHERE conversation_id = :id "
+            "ORDER BY date DESC LIMIT :limit"
+        ),
+        {"id": conversation_id, "limit": WARMUP_MESSAGES},
+    ).fetchall()
+
+    media = conn.execute(
+        text(
+            "SELECT * FROM media WHERE conversation_id = :id "
+            "ORDER BY date DESC, id DESC LIMIT :limit"
+        ),
+        {"id": conversation_id, "limit": WARMUP_MEDIA},
+    ).mappings()
+    for row in media:
+        if row["file_path"]:
+            try:
+                os.stat(row["file_path"])
+            except OSError:
+                pass
+
+
+def warm_owner(owner: str, conversations: int = WARMUP_CONVERSATIONS):
+    started = time.monotonic()
+    with get_engine(owner).connect() as conn:
+        warm_indexes(conn)
+        conversation_ids = recent_conversation_ids(conn, conversations)
+        for conversation_id in conversation_ids:
+            warm_conversation(conn, conversation_id)
+
+    print(
+        f"Warmed up {owner} ({len(conversation_ids)} conversations) "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+
+
+def warm_up():
+    for owner in list_owners():
+        try:
+            warm_owner(owner)
+        except Exception as e:
+            print(f"Warm up failed for {owner}: {e}")
+
+
+def start_warmup():
+    """Start warming up in the background when WARMUP_ON_START is set"""
+    if not WARMUP_ON_START:
+        return None
+
+    thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,302 @@
+import hashlib
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from sqlmodel import select
+from .db import DEFAULT_OWNER, owner_session, valid_owner
+from .models import IngestedArchive
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+WATCH_DIR = os.environ.get("WATCH_DIR")
+WATCH_USER_ADDRESS = os.environ.get("WATCH_USER_ADDRESS")
+# Archives under <WATCH_DIR>/owners/<owner>/ are imported into that owner's
+# database, as "owner=number,owner=number"
+WATCH_OWNER_ADDRESSES = os.environ.get("WATCH_OWNER_ADDRESSES", "")
+
+# A file must keep the same size and mtime for this long before it's treated
+# as fully written. Sync tools often write in bursts with pauses between.
+SETTLE_SECONDS = float(os.environ.get("WATCH_SETTLE_SECONDS", 30))
+POLL_SECONDS = float(os.environ.get("WATCH_POLL_SECONDS", 60))
+
+ARCHIVE_SUFFIXES = {".xml", ".csv"}
+TEMPORARY_SUFFIXES = {".part", ".tmp", ".crdownload", ".partial"}
+
+
+def is_archive(path: Path) -> bool:
+    if path.name.startswith(".") or path.name.endswith("~"):
+        return False
+
+    if any(suffix in TEMPORARY_SUFFIXES for suffix in path.suffixes):
+        return False
+
+    return path.suffix.lower() in ARCHIVE_SUFFIXES
+
+
+def file_sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def parse_owner_addresses(value: str) -> dict[str, str]:
+    addresses = {}
+    for entry in value.split(","):
+        owner, _, address = entry.strip().partition("=")
+        if owner and address:
+            addresses[owner.strip()] = address.strip()
+
+    return addresses
+
+
+def attachments_dir_for(csv_path: Path) -> Optional[Path]:
+    """iMessage exports keep attachments in a folder next to the CSV"""
+    for name in (csv_path.stem, f"{csv_path.stem}_attachments", "attachments"):
+        candidate = csv_path.parent / name
+        if candidate.is_dir():
+            return candidate
+
+    return None
+
+
+class ArchiveWatcher:
+    """
+    Watches `directory` for new or changed SMS Backup & Restore XML and
+    iMessage CSV exports and imports them in the background. Each owner's
+    archives are imported one at a time, different owners' in parallel.
+    Uses inotify when inotify_simple is installed and it can be set up, and
+    rescans the directory every `poll_seconds` either way, since writes on
+    network mounts (NFS, CIFS) don't produce inotify events.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        user_address: Optional[str],
+        settle_seconds: float = SETTLE_SECONDS,
+        poll_seconds: float = POLL_SECONDS,
+        owner_addresses: Optional[dict[str, str]] = None,
+    ):
+        self.directory = Path(directory)
+        self.user_address = user_address
+        self.owner_addresses = owner_addresses or {}
+        self.settle_seconds = settle_seconds
+        self.poll_seconds = poll_seconds
+
+        self.seen: dict[Path, tuple[int, float]] = {}
+        self.pending: dict[Path, tuple[int, float, float]] = {}
+        self.queues: dict[str, queue.Queue[Path]] = {}
+
+        self.inotify = None
+        self.watches: dict[int, Path] = {}
+
+    def start_inotify(self):
+        if INotify is None:
+            print("inotify_simple not installed, polling for new archives")
+            return
+
+        try:
+            self.inotify = INotify()
+            for directory in [self.directory, *self.directory.rglob("*")]:
+                if directory.is_dir():
+                    self.add_watch(directory)
+        except OSError as e:
+            # Out of inotify instances or max_user_watches
+            print(f"Could not set up inotify ({e}), polling for new archives")
+            if self.inotify is not None:
+                self.inotify.close()
+            self.inotify = None
+            self.watches.clear()
+
+    def add_watch(self, directory: Path):
+        mask = (
+            flags.CLOSE_WRITE
+            | flags.MOVED_TO
+            | flags.CREATE
+            | flags.MODIFY
+            | flags.ONLYDIR
+        )
+        self.watches[self.inotify.add_watch(directory, mask)] = directory
+
+    def read_events(self, timeout: float):
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            directory = self.watches.get(event.wd)
+            if directory is None or not event.name:
+                continue
+
+            path = directory / event.name
+            if event.mask & flags.ISDIR:
+                try:
+                    self.add_watch(path)
+                except OSError as e:
+                    # The periodic scan still picks up files in it
+                    print(f"Could not watch {path}: {e}")
+                self.scan(path)
+            else:
+                self.touch(path)
+
+    def scan(self, directory: Path):
+        for path in directory.rglob("*"):
+            if path.is_file():
+                self.touch(path)
+
+    def touch(self, path: Path):
+        """Note that `path` may have changed, it's queued once it settles"""
+        if not is_archive(path):
+            return
+
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self.pending.pop(path, None)
+            return
+
+        signature = (stat.st_size, stat.st_mtime)
+        if self.seen.get(path) == signature:
+            return
+
+        previous = self.pending.get(path)
+        if previous is None or previous[:2] != signature:
+            self.pending[path] = (*signature, time.monotonic())
+
+    def check_pending(self):
+        now = time.monotonic()
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self.pending[path] = (stat.st_size, stat.st_mtime, now)
+            elif now - since >= self.settle_seconds:
+                del self.pending[path]
+                self.seen[path] = (size, mtime)
+                self.queue_for(self.owner_for(path)).put(path)
+
+    def owner_for(self, path: Path) -> Optional[str]:
+        parts = path.relative_to(self.directory).parts
+        if len(parts) > 2 and parts[0] == "owners":
+            return parts[1] if valid_owner(parts[1]) else None
+
+        return DEFAULT_OWNER
+
+    def queue_for(self, owner: Optional[str]) -> queue.Queue:
+        paths = self.queues.get(owner)
+        if paths is None:
+            paths = self.queues[owner] = queue.Queue()
+            threading.Thread(
+                target=self.worker, args=(owner, paths), daemon=True
+            ).start()
+
+        return paths
+
+    def ingest(self, path: Path, owner: Optional[str]):
+        if owner is None:
+            print(f"Skipping {path}, not a valid owner directory")
+            return
+
+        # Falling back to the default owner's number for someone else would
+        # import their backup with the wrong "Me"
+        if owner == DEFAULT_OWNER:
+            user_address = self.owner_addresses.get(owner, self.user_address)
+        else:
+            user_address = self.owner_addresses.get(owner)
+        if not user_address:
+            print(f"Skipping {path}, no user number configured for {owner}")
+            return
+
+        stat = path.stat()
+        with owner_session(owner) as session:
+            # Cheap check first, the same file at the same size and mtime
+            # doesn't need hashing again
+            unchanged = session.exec(
+                select(IngestedArchive).where(
+                    IngestedArchive.path == str(path),
+                    IngestedArchive.size == stat.st_size,
+                    IngestedArchive.mtime == stat.st_mtime,
+                )
+            ).first()
+            if unchanged:
+                return
+
+            sha256 = file_sha256(path)
+            ingested = session.exec(
+                select(IngestedArchive).where(IngestedArchive.sha256 == sha256)
+            ).first()
+            if ingested:
+                print(f"Skipping {path}, already imported")
+                return
+
+            # The watcher sits idle most of the time, load the parsers once
+            # there's something to import
+            from .parser import CSV, SMSBackupAndRestore
+
+            print(f"Importing {path} for {owner}")
+            started = time.monotonic()
+            if path.suffix.lower() == ".xml":
+                importer = SMSBackupAndRestore(session)
+                importer.parse_sms_xml_stream(str(path), user_address)
+            else:
+                attachments_dir = attachments_dir_for(path)
+                importer = CSV(
+                    session,
+                    str(path),
+                    str(attachments_dir) if attachments_dir else None,
+                )
+                importer.parse(user_address)
+
+            session.add(
+                IngestedArchive(
+                    path=str(path),
+                    sha256=sha256,
+                    size=stat.st_size,
+                    mtime=stat.st_mtime,
+                    ingested_at=datetime.now(),
+                )
+            )
+            session.commit()
+            print(f"Imported {path} in {time.monotonic() - started:.1f}s")
+
+    def worker(self, owner: Optional[str], paths: queue.Queue):
+        while True:
+            path = paths.get()
+            try:
+                self.ingest(path, owner)
+            except Exception as e:
+                # It stays in `seen` at the size and mtime that failed, so
+                # only a change to the file retries it rather than every scan
+                print(f"Failed to import {path}: {e}")
+            finally:
+                paths.task_done()
+
+    def run(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.start_inotify()
+
+        # Pick up anything dropped in while we weren't running
+        self.scan(self.directory)
+        last_scan = time.monotonic()
+
+        while True:
+            if self.inotify is not None:
+                self.read_events(timeout=1)
+            else:
+                time.sleep(1)
+
+            if time.monotonic() - last_scan >= self.poll_seconds:
+                self.scan(self.directory)
+                last_scan = time.monotonic()
+
+            self.check_pending()
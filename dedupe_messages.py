@@ -0,0 +1,114 @@
+# dedupe_messages.py
+
+import argparse
+import csv
+import time
+from sqlmodel import select
+from sqlalchemy import func
+from app.db import DEFAULT_OWNER, owner_session, valid_owner
+from app.dedupe import find_duplicates, merge_duplicates
+from app.models import Conversation, Message
+
+
+def print_pair(pair):
+    keep, duplicate = pair.keep, pair.duplicate
+    text = (keep.text or "").replace("\n", " ")[:60]
+    print(
+        f"  keep {keep.id} (conversation {keep.conversation_id}) "
+        f"drop {duplicate.id} (conversation {duplicate.conversation_id}) "
+        f"{abs(keep.seconds - duplicate.seconds):.3f}s apart: {text!r}"
+    )
+
+
+def write_report(pairs, path: str):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [
+                "keep_id",
+                "keep_conversation_id",
+                "duplicate_id",
+                "duplicate_conversation_id",
+                "seconds_apart",
+                "text",
+            ]
+        )
+        for pair in pairs:
+            writer.writerow(
+                [
+                    pair.keep.id,
+                    pair.keep.conversation_id,
+                    pair.duplicate.id,
+                    pair.duplicate.conversation_id,
+                    f"{abs(pair.keep.seconds - pair.duplicate.seconds):.3f}",
+                    pair.keep.text,
+                ]
+            )
+
+
+def dedupe(
+    window: float, dry_run: bool, report: str | None, owner: str = DEFAULT_OWNER
+):
+    with owner_session(owner) as session:
+        started = time.monotonic()
+        pairs = find_duplicates(session, window)
+        print(
+            f"Found {len(pairs)} duplicate messages in "
+            f"{time.monotonic() - started:.1f}s"
+        )
+
+        by_conversations = {}
+        for pair in pairs:
+            key = (pair.keep.conversation_id, pair.duplicate.conversation_id)
+            by_conversations.setdefault(key, []).append(pair)
+
+        for (keep_id, duplicate_id), conversation_pairs in sorted(
+            by_conversations.items(), key=lambda item: -len(item[1])
+        ):
+            print(
+                f"Conversation {duplicate_id} -> {keep_id}: "
+                f"{len(conversation_pairs)} duplicates"
+            )
+            for pair in conversation_pairs[:3]:
+                print_pair(pair)
+
+        if report:
+            write_report(pairs, report)
+            print(f"Wrote report to {report}")
+
+        if dry_run or not pairs:
+            return
+
+        merge_duplicates(session, pairs)
+
+        empty = session.exec(
+            select(func.count(Conversation.id)).where(
+                ~Conversation.id.in_(select(Message.conversation_id))
+            )
+        ).one()
+        print(f"Merged {len(pairs)} duplicates, {empty} conversations are now empty")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find and merge messages imported from more than one archive"
+    )
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=2.0,
+        help="maximum seconds between two copies of a message",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="report duplicates without merging"
+    )
+    parser.add_argument("--report", help="write every duplicate pair to this CSV")
+    parser.add_argument(
+        "--owner", default=DEFAULT_OWNER, help="whose archive to dedupe"
+    )
+    args = parser.parse_args()
+
+    if not valid_owner(args.owner):
+        parser.error(f"invalid owner {args.owner!r}")
+
+    dedupe(args.window, args.dry_run, args.report, args.owner)
@@ -12,7 +12,12 @@ import {
   Affix,
 } from "@mantine/core";
 import { useNavigate, useParams, useSearchParams } from "react-router-dom";
-import type { Message, Conversation, Media } from "../types";
+import type {
+  Message,
+  Conversation,
+  Media,
+  CompactMessages,
+} from "../types";
 import MediaModal from "../components/MediaModal";
 
 const PAGE_SIZE = 50;
@@ -24,8 +29,45 @@ type ConversationMessagesResponse = {
   total: number;
 };
 
+type CompactConversationMessagesResponse = CompactMessages & {
+  has_more: boolean;
+  has_newer: boolean;
+  total: number;
+};
+
 // const SCROLL_THRESHOLD: number = 100;
 
+// Expand the compact (parallel array) response back into message objects
+function decodeCompactMessages({
+  contacts,
+  messages,
+  media,
+  ...rest
+}: CompactConversationMessagesResponse): ConversationMessagesResponse {
+  const contactNames = contacts.id.map(
+    (_, i) => contacts.name[i] || contacts.address[i]
+  );
+
+  const decoded: Message[] = messages.id.map((id, i) => ({
+    id,
+    direction: messages.direction[i],
+    text: messages.text[i],
+    date: messages.date[i],
+    contact: contactNames[messages.contact[i]],
+    media: [],
+  }));
+
+  media.id.forEach((id, i) => {
+    decoded[media.message[i]].media.push({
+      id,
+      filename: media.filename[i],
+      content_type: media.content_type[i],
+    });
+  });
+
+  return { ...rest, messages: decoded };
+}
+
 function useDebounce(value: string, delay = 500) {
   const [debouncedValue, setDebouncedValue] = useState(value);
 
@@ -70,7 +112,10 @@ export default function Conversation() {
       limit = 50,
     }: { beforeId?: number; afterId?: number; limit?: number } = {}
   ): Promise<ConversationMessagesResponse> => {
-    const params = new URLSearchParams({ limit: limit.toString() });
+    const params = new URLSearchParams({
+      limit: limit.toString(),
+      format: "compact",
+    });
 
     if (beforeId) {
       params.append("start_before_message_id", beforeId.toString());
@@ -84,7 +129,7 @@ export default function Conversation() {
     if (!res.ok) {
       throw new Error("Failed to fetch messages");
     }
-    return await res.json();
+    return decodeCompactMessages(await res.json());
   };
 
   const fetchInitialMessages = async (startingId: string | null = null) => {
@@ -7,6 +7,7 @@ import {
   Grid,
   Tooltip,
   ActionIcon,
+  SegmentedControl,
 } from "@mantine/core";
 import { useNavigate, useParams } from "react-router-dom";
 import type { Media, ConversationMedia } from "../types";
@@ -18,16 +19,20 @@ const PAGE_SIZE = 30;
 type ConversationMediaResponse = {
   media: ConversationMedia[];
   has_more: boolean;
-  total: number;
+  next_cursor: string | null;
+  total: number | null;
 };
 
+type MediaFilter = "all" | "image" | "video";
+
 export default function ConversationMedia() {
   const { conversationId } = useParams();
 
   const navigate = useNavigate();
 
   const [media, setMedia] = useState<ConversationMedia[]>([]);
-  const [offset, setOffset] = useState(0);
+  const [cursor, setCursor] = useState<string | null>(null);
+  const [filter, setFilter] = useState<MediaFilter>("all");
   const [hasMore, setHasMore] = useState(true);
   const [loading, setLoading] = useState(false);
   const [mediaModalOpen, setMediaModalOpen] = useState<boolean>(false);
@@ -36,36 +41,48 @@ export default function ConversationMedia() {
   const scrollRef = useRef<HTMLDivElement>(null);
   const innerRef = useRef<HTMLDivElement>(null);
   const firstLoad = useRef(true);
+  // Only the latest request's response is used, so a page still loading
+  // for the previous filter can't land in the new filter's list
+  const requestId = useRef(0);
 
-  const fetchMedia = async (newOffset: number) => {
-    if (newOffset != 0) {
+  const fetchMedia = async (before: string | null) => {
+    if (before) {
       if (!hasMore || loading) return;
     }
+    const id = ++requestId.current;
     setLoading(true);
     try {
       const url = new URL(
         `/api/conversation/${conversationId}/media`,
         window.location.origin
       );
-      url.searchParams.set("offset", newOffset.toString());
+      if (before) {
+        url.searchParams.set("before", before);
+      }
+      if (filter !== "all") {
+        url.searchParams.set("kind", filter);
+      }
       url.searchParams.set("limit", PAGE_SIZE.toString());
 
       const res: ConversationMediaResponse = await (
         await fetch(url.toString())
       ).json();
 
-      const newMedia = res.media.sort((a, b) => (a.date < b.date ? 1 : -1));
+      if (id !== requestId.current) return;
+
+      // Already newest first
+      const newMedia = res.media;
       setHasMore(res.has_more);
-      setOffset(newOffset + newMedia.length);
+      setCursor(res.next_cursor);
 
-      if (newOffset > 0) {
+      if (before) {
         setMedia((prev) => [...prev, ...newMedia]);
       } else {
         setMedia(newMedia);
       }
 
       // Maintain scroll position after update
-      if (newOffset > 0) {
+      if (before) {
         if (innerRef.current && !firstLoad.current) {
           const prevHeight = innerRef.current.scrollHeight;
           requestAnimationFrame(() => {
@@ -77,13 +94,17 @@ export default function ConversationMedia() {
         }
       }
     } finally {
-      setLoading(false);
+      if (id === requestId.current) {
+        setLoading(false);
+      }
     }
   };
 
   useEffect(() => {
-    fetchMedia(0);
-  }, []);
+    setCursor(null);
+    setHasMore(true);
+    fetchMedia(null);
+  }, [filter]);
 
   useEffect(() => {
     // Scroll to bottom on initial load
@@ -98,8 +119,8 @@ export default function ConversationMedia() {
 
     const { scrollTop, scrollHeight, clientHeight } = scrollRef.current;
 
-    if (scrollTop + clientHeight >= scrollHeight - 100) {
-      fetchMedia(offset);
+    if (cursor && scrollTop + clientHeight >= scrollHeight - 100) {
+      fetchMedia(cursor);
     }
   };
 
@@ -125,7 +146,17 @@ export default function ConversationMedia() {
         onScrollPositionChange={handleScroll}
       >
         <Stack ref={innerRef} p="md">
-          {loading && offset === 0 && (
+          <SegmentedControl
+            value={filter}
+            onChange={(value) => setFilter(value as MediaFilter)}
+            data={[
+              { label: "All", value: "all" },
+              { label: "Images", value: "image" },
+              { label: "Videos", value: "video" },
+            ]}
+          />
+
+          {loading && !cursor && (
             <Center>
               <Loader />
             </Center>
@@ -190,7 +221,7 @@ export default function ConversationMedia() {
             </Grid>
           </div>
 
-          {loading && offset > 0 && (
+          {loading && cursor && (
             <Center>
               <Loader size="sm" />
             </Center>
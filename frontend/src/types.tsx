@@ -20,6 +20,9 @@ export interface ConversationMedia {
   id: number;
   content_type: string;
   filename: string;
+  kind: "image" | "video" | "audio" | "other";
+  width: number | null;
+  height: number | null;
   message_id: number;
   date: string;
   contact_id: number;
@@ -35,3 +38,26 @@ export interface Message {
   date: string;
   media: Media[];
 }
+
+export interface CompactContacts {
+  id: number[];
+  name: (string | null)[];
+  address: string[];
+}
+
+export interface CompactMessages {
+  contacts: CompactContacts;
+  messages: {
+    id: number[];
+    direction: ("inbox" | "sent")[];
+    text: string[];
+    date: string[];
+    contact: number[];
+  };
+  media: {
+    message: number[];
+    id: number[];
+    filename: string[];
+    content_type: string[];
+  };
+}
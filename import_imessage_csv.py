@@ -1,26 +1,59 @@
 # cli.py
 
 import sys
-from sqlmodel import SQLModel, Session, create_engine
 from app.parser import CSV
+from app.db import DEFAULT_OWNER, get_engine, owner_session, valid_owner
+from app.profiling import install_sql_tracing, profiled
 from typing import Optional
 
-sqlite_url = "sqlite:////data/sms.db"
-engine = create_engine(sqlite_url)
 
-
-def ingest_csv(filepath: str, user_address: str, attachments_dir: Optional[str] = None):
-    SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
+def ingest_csv(
+    filepath: str,
+    user_address: str,
+    attachments_dir: Optional[str] = None,
+    owner: str = DEFAULT_OWNER,
+    workers: int = 1,
+):
+    with owner_session(owner) as session:
         importer = CSV(session, filepath, attachments_dir)
-        importer.parse(user_address)
+        if workers > 1:
+            importer.parse_parallel(user_address, workers)
+        else:
+            importer.parse(user_address)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python cli.py path/to/file.csv user_number attachments_dir")
+    profile = "--profile" in sys.argv
+    args = [arg for arg in sys.argv if arg != "--profile"]
+
+    owner = DEFAULT_OWNER
+    if "--owner" in args[:-1]:
+        index = args.index("--owner")
+        owner = args[index + 1]
+        del args[index : index + 2]
+
+    workers = 1
+    if "--workers" in args[:-1]:
+        index = args.index("--workers")
+        workers = int(args[index + 1]) if args[index + 1].isdigit() else 0
+        del args[index : index + 2]
+
+    if len(args) != 4 or not valid_owner(owner) or workers < 1:
+        print(
+            "Usage: python cli.py path/to/file.csv user_number attachments_dir "
+            "[--owner NAME] [--workers N] [--profile]"
+        )
         sys.exit(1)
 
-    filepath = sys.argv[1]
-    user_address = sys.argv[2] if len(sys.argv) > 2 else None
-    ingest_csv(filepath, user_address, sys.argv[3])
+    filepath = args[1]
+    user_address = args[2] if len(args) > 2 else None
+
+    engine = get_engine(owner)
+
+    if profile:
+        install_sql_tracing(engine)
+        with profiled("import_imessage_csv", filepath=filepath) as trace:
+            ingest_csv(filepath, user_address, args[3], owner, workers)
+        print(f"Profile written to {trace.info['output']}")
+    else:
+        ingest_csv(filepath, user_address, args[3], owner, workers)
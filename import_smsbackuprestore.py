@@ -1,25 +1,44 @@
 # cli.py
 
 import sys
-from sqlmodel import SQLModel, Session, create_engine
 from app.parser import SMSBackupAndRestore
+from app.db import DEFAULT_OWNER, get_engine, owner_session, valid_owner
+from app.profiling import install_sql_tracing, profiled
 
-sqlite_url = "sqlite:////data/sms.db"
-engine = create_engine(sqlite_url)
 
-
-def ingest_large_xml(filepath: str, user_address: str):
-    SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
+def ingest_large_xml(filepath: str, user_address: str, owner: str = DEFAULT_OWNER):
+    with owner_session(owner) as session:
         importer = SMSBackupAndRestore(session)
         importer.parse_sms_xml_stream(filepath, user_address)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python cli.py path/to/file.xml user_number")
+    profile = "--profile" in sys.argv
+    args = [arg for arg in sys.argv if arg != "--profile"]
+
+    owner = DEFAULT_OWNER
+    if "--owner" in args[:-1]:
+        index = args.index("--owner")
+        owner = args[index + 1]
+        del args[index : index + 2]
+
+    if len(args) != 3 or not valid_owner(owner):
+        print(
+            "Usage: python cli.py path/to/file.xml user_number [--owner NAME] [--profile]"
+        )
         sys.exit(1)
 
-    filepath = sys.argv[1]
-    user_address = sys.argv[2] if len(sys.argv) > 2 else None
-    ingest_large_xml(filepath, user_address)
+    filepath = args[1]
+    user_address = args[2] if len(args) > 2 else None
+
+    # Each owner has their own database, so imports for different owners
+    # can run at the same time
+    engine = get_engine(owner)
+
+    if profile:
+        install_sql_tracing(engine)
+        with profiled("import_smsbackuprestore", filepath=filepath) as trace:
+            ingest_large_xml(filepath, user_address, owner)
+        print(f"Profile written to {trace.info['output']}")
+    else:
+        ingest_large_xml(filepath, user_address, owner)
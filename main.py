@@ -1,25 +1,44 @@
 # main.py
+import time
+
+imports_started = time.perf_counter()
+
 from fastapi import FastAPI
 from app.api import router
-from app.models import SQLModel
-from app.db import engine
+from app.db import add_engine_hook, get_engine
+from app.profiling import (
+    install_sql_tracing,
+    profile_requests,
+    profiled_startup,
+    startup_report,
+)
+from app.warmup import start_warmup
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi import FastAPI, Request
 from pathlib import Path
 from contextlib import asynccontextmanager
 
+startup_report.add("imports", time.perf_counter() - imports_started)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Load the ML model
-    SQLModel.metadata.create_all(engine)
+    with profiled_startup():
+        # Other owners' databases are opened and upgraded on first use
+        with startup_report.phase("schema"):
+            get_engine()
+
+    # Runs while requests are already being served
+    start_warmup()
     yield
     # run shutdown code after yield
 
 
 app = FastAPI(title="SMS API", lifespan=lifespan)
-
+app.middleware("http")(profile_requests)
+add_engine_hook(install_sql_tracing)
 
 app.include_router(router, prefix="/api")
 
@@ -0,0 +1,79 @@
+# migrate.py
+
+import argparse
+from sqlalchemy import text
+from sqlmodel import create_engine
+from app.db import (
+    DEFAULT_OWNER,
+    list_owners,
+    owner_dir,
+    owner_exists,
+    sqlite_file_name,
+    upgrade_schema,
+    valid_owner,
+)
+from app.migrations import BATCH_SIZE, MIGRATIONS, applied_versions
+
+
+def status(engine):
+    applied = applied_versions(engine)
+    with engine.begin() as conn:
+        applied_at = dict(
+            conn.execute(
+                text("SELECT version, applied_at FROM schema_migrations")
+            ).all()
+        )
+        progress = dict(
+            conn.execute(
+                text("SELECT version, position FROM schema_migration_progress")
+            ).all()
+        )
+
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            state = f"applied {applied_at[migration.version]}"
+        elif migration.version in progress:
+            state = f"in progress, up to id {progress[migration.version]}"
+        else:
+            state = "pending"
+
+        print(f"{migration.version:>4}  {migration.name:<30} {state}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    owners = parser.add_mutually_exclusive_group()
+    owners.add_argument("--owner", default=DEFAULT_OWNER, help="whose database")
+    owners.add_argument("--all-owners", action="store_true", help="every database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="list migrations and whether they've run")
+
+    up_parser = subparsers.add_parser("up", help="apply pending migrations")
+    up_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="rows updated per transaction by backfills",
+    )
+
+    args = parser.parse_args()
+
+    if not valid_owner(args.owner):
+        parser.error(f"invalid owner {args.owner!r}")
+
+    for owner in list_owners() if args.all_owners else [args.owner]:
+        # A plain engine rather than db.get_engine(), which would migrate
+        # before `status` gets to look
+        engine = create_engine(f"sqlite:///{owner_dir(owner) / sqlite_file_name}")
+        if args.all_owners:
+            print(f"{owner}:")
+
+        if args.command == "status":
+            if owner_exists(owner):
+                status(engine)
+            else:
+                print(f"No database for {owner}")
+        else:
+            owner_dir(owner).mkdir(parents=True, exist_ok=True)
+            upgrade_schema(engine, batch_size=args.batch_size)
@@ -0,0 +1,146 @@
+# pack_media.py
+
+import argparse
+import os
+from collections import defaultdict
+from pathlib import Path
+from sqlmodel import select
+from app.models import Media
+from app.db import DEFAULT_OWNER, owner_session, pack_dir, valid_owner
+from app.packstore import PackWriter, list_segments, segment_path
+
+BATCH_SIZE = 500
+
+
+def pack_media_files(delete: bool = False, owner: str = DEFAULT_OWNER):
+    """Move one-file-per-part attachments into pack segments"""
+    writer = PackWriter(pack_dir(owner))
+    packed = 0
+    packed_bytes = 0
+    last_id = 0
+
+    with owner_session(owner) as session:
+        while True:
+            batch = session.exec(
+                select(Media)
+                .where(Media.pack_segment.is_(None), Media.file_path.is_not(None))
+                .where(Media.id > last_id)
+                .order_by(Media.id)
+                .limit(BATCH_SIZE)
+            ).all()
+            if not batch:
+                break
+
+            done = []
+            for media in batch:
+                last_id = media.id
+                path = Path(media.file_path)
+                if not path.is_file():
+                    print(f"Skipping media {media.id}, missing file {path}")
+                    continue
+
+                data = path.read_bytes()
+                media.pack_segment, media.pack_offset, media.pack_length = (
+                    writer.append(data)
+                )
+                if delete:
+                    media.file_path = None
+                session.add(media)
+                done.append(path)
+                packed_bytes += len(data)
+
+            # Make the packed bytes durable before rows point at them
+            writer.close()
+            session.commit()
+            packed += len(batch)
+
+            if delete:
+                for path in done:
+                    path.unlink(missing_ok=True)
+
+            print(f"Packed {packed} media ({packed_bytes / 1024**2:.1f} MiB)")
+
+    writer.close()
+
+
+def compact_segments(threshold: float = 0.5, owner: str = DEFAULT_OWNER):
+    """
+    Rewrite segments whose live data has dropped below `threshold` of their
+    size (e.g. after messages were deleted) and remove the old files. The
+    newest segment is still being appended to and is never compacted.
+    """
+    owner_pack_dir = pack_dir(owner)
+    segments = list_segments(owner_pack_dir)
+    if len(segments) < 2:
+        print("Nothing to compact")
+        return
+
+    with owner_session(owner) as session:
+        live_bytes = defaultdict(int)
+        for segment, length in session.exec(
+            select(Media.pack_segment, Media.pack_length).where(
+                Media.pack_segment.is_not(None)
+            )
+        ):
+            live_bytes[segment] += length
+
+        writer = PackWriter(owner_pack_dir)
+        for segment in segments[:-1]:
+            path = segment_path(segment, owner_pack_dir)
+            size = os.path.getsize(path)
+            ratio = live_bytes[segment] / size if size else 0
+            if ratio >= threshold:
+                continue
+
+            print(f"Compacting segment {segment} ({ratio:.0%} live)")
+            rows = session.exec(
+                select(Media)
+                .where(Media.pack_segment == segment)
+                .order_by(Media.pack_offset)
+            ).all()
+
+            with open(path, "rb") as f:
+                for media in rows:
+                    f.seek(media.pack_offset)
+                    data = f.read(media.pack_length)
+                    media.pack_segment, media.pack_offset, media.pack_length = (
+                        writer.append(data)
+                    )
+                    session.add(media)
+
+            writer.close()
+            session.commit()
+            # Rows no longer reference the old segment, so it's safe to drop.
+            # Servers holding a map of it keep it valid until they exit.
+            path.unlink()
+
+        writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage packed media storage")
+    parser.add_argument("--owner", default=DEFAULT_OWNER, help="whose media to manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pack = commands.add_parser("pack", help="pack media files into segment files")
+    pack.add_argument(
+        "--delete", action="store_true", help="remove original files once packed"
+    )
+
+    compact = commands.add_parser("compact", help="reclaim space from deleted media")
+    compact.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="compact segments with less than this fraction of live data",
+    )
+
+    args = parser.parse_args()
+
+    if not valid_owner(args.owner):
+        parser.error(f"invalid owner {args.owner!r}")
+
+    if args.command == "pack":
+        pack_media_files(args.delete, args.owner)
+    elif args.command == "compact":
+        compact_segments(args.threshold, args.owner)
@@ -0,0 +1,52 @@
+# watch_imports.py
+
+import argparse
+from app.watcher import (
+    ArchiveWatcher,
+    POLL_SECONDS,
+    SETTLE_SECONDS,
+    WATCH_DIR,
+    WATCH_OWNER_ADDRESSES,
+    WATCH_USER_ADDRESS,
+    parse_owner_addresses,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import new or changed backups dropped into a folder"
+    )
+    parser.add_argument("directory", nargs="?", default=WATCH_DIR)
+    parser.add_argument("user_number", nargs="?", default=WATCH_USER_ADDRESS)
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=SETTLE_SECONDS,
+        help="seconds a file must stay unchanged before it's imported",
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=POLL_SECONDS,
+        help="seconds between directory scans when inotify isn't available",
+    )
+    parser.add_argument(
+        "--owner-addresses",
+        default=WATCH_OWNER_ADDRESSES,
+        help="user numbers for archives under owners/<owner>/, as owner=number,...",
+    )
+    args = parser.parse_args()
+
+    owner_addresses = parse_owner_addresses(args.owner_addresses)
+    if not args.directory or not (args.user_number or owner_addresses):
+        parser.error(
+            "a directory and user number are required (or WATCH_DIR and WATCH_USER_ADDRESS)"
+        )
+
+    watcher = ArchiveWatcher(
+        args.directory,
+        args.user_number,
+        args.settle,
+        args.poll,
+        owner_addresses,
+    )
+    watcher.run()